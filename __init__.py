@@ -7,6 +7,9 @@ requires: Python 2.7 -   http://python.org/
           Musicbrainz2 - http://musicbrainz.org/doc/python-musicbrainz2
           Acoustid -     http://acoustid.org/fingerprinter
           Chromaprint -  http://acoustid.org/chromaprint
+          Pyinotify -    https://github.com/seb-m/pyinotify  # Linux only
+          Scandir -      https://github.com/benhoyt/scandir  # Optional
+          NumPy -        http://numpy.org/  # Optional
           PyTest -       http://pytest.org/  # Only needed for tests
 
 
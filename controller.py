@@ -3,8 +3,27 @@
 Handles the processing and construction of Albums and Tracks
 
 Provided Functions:
-    build_albums(album:Album, path:str)
-    Produce iterables of Albums on path
+    build_track(path:str, lazy=False:bool, scan=False:bool)
+    Create a Track from a path, optionally deferring parsing its tags
+    or reading only the regions of the file that hold them
+
+    build_albums(path:str, recursive=False:bool, workers=None:int,
+                 index=None:TagIndex, extensions=AUDIO_EXTENSIONS:set,
+                 scan=False:bool, lazy=False:bool)
+    Produce iterables of Albums on path, optionally in parallel, from a
+    TagIndex, reading only the regions of files that hold tags, or
+    deferring parsing until tags are used
+
+    rescan_albums(path:str, index:TagIndex)
+    Produce AlbumDeltas for albums added, changed or removed since the
+    last rescan of path
+
+    refresh_albums(paths:iterable, index:TagIndex)
+    Produce AlbumDeltas for albums in directories known to have changed
+
+    scan_statistics
+    Counter of the files parsed, bytes read and tracks built by
+    build_albums
 
     find_shared_tags(album:Album)
     Collects shared fields into a dict
@@ -15,12 +34,28 @@ Provided Functions:
     rename_tracks(target:Album|Track)
     Renames Track or Tracks in an Album
 
-    retag_album(album:Album, mapping:dict)
+    retag_album(album:Album, mapping:dict, commit=True:bool)
     Retag an Album and contents based on a mapping
 
-    retag_track(track:Track, mapping:dict)
+    retag_track(track:Track, mapping:dict, commit=True:bool)
     Retag a Track based on a mapping
 
+    commit_tracks(tracks:Tracks, workers=None:int)
+    Saves staged changes, once per track, optionally in parallel
+
+    fingerprint_albums(albums:Albums, workers=0:int)
+    Fingerprints every track of the albums on a pool of processes,
+    yielding each track and fingerprint as they finish
+
+    find_duplicates(albums:Albums, workers=None:int, index=None:TagIndex)
+    Groups the tracks of albums that carry the same audio
+
+    find_near_duplicates(albums:Albums, workers=None:int)
+    Groups the tracks of albums whose fingerprints are alike (NumPy)
+
+    audio_changed(tracks:Tracks, index:TagIndex)
+    Returns the tracks whose audio differs from that last indexed
+
     missing_fields(target:Album|Track)
     Returns list of fields that have missing tags
 
@@ -34,17 +69,48 @@ Provided Functions:
     Creates a container album with the given tracks and optional album name
 
     flush_changes(target:Albums|Tracks)
-    Saves changes to any number of tracks and/or albums
+    Saves changes to any number of tracks and/or albums, returning the
+    number of files written
+
+Provided Classes:
+    SharedTags()
+    Collects shared fields from tracks added and removed a few at a time
 """
 
 import os
-from collections import Counter
+import time
+from stat import S_ISDIR, S_ISREG
+from collections import Counter, OrderedDict, namedtuple
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
 
-from mutagen import File
+import acoustid
+from mutagen import File, MutagenError
 
 from r3tagger.model.album import Album
 from r3tagger.model.track import Track
 from r3tagger.library import filename
+from r3tagger.library.fingerprint import FingerprintCache
+from r3tagger.library.index import (TagIndex, file_signature,
+                                    directory_signature)
+from r3tagger.library.scan import (AUDIO_EXTENSIONS, list_directory, walk,
+                                   read_tags)
+
+
+# Counts of files 'parsed', 'bytes' read, 'cached' and 'tracks' built
+scan_statistics = Counter()
+
+# TagIndex connections opened by each build_albums worker process
+_worker_indexes = {}
+
+# FingerprintCache connections opened by each fingerprint_albums worker
+_worker_fingerprints = {}
+
+# Directories modified this recently are rescanned on the next rescan
+_RACY_SECONDS = 2
+
+AlbumDelta = namedtuple('AlbumDelta', 'status path album')
 
 
 class NoFileFoundError(Exception):
@@ -60,109 +126,495 @@ def set_album_path(album, path):
         track.path = os.path.join(path, filename(track.path))
 
 
-def build_track(path):
-    """Create a Track based on a path"""
-    if os.path.isfile(path):
-        return Track(path)
-    else:
+def build_track(path, lazy=False, scan=False):
+    """Create a Track based on a path
+
+    A lazy Track defers parsing its tags until they are first used (see
+    Track), for listings that may never read them. A scan Track only
+    reads the regions of its file that hold tags (see
+    library.scan.read_tags), and reports the bytes read as its
+    bytes_read. Either way, the Track keeps the stat result of its file.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+
+    if stat is None or not S_ISREG(stat.st_mode):
         raise NoFileFoundError("No file exists at {}".format(path))
 
+    return Track(path, lazy=lazy, reader=read_tags if scan else None,
+                 stat=stat)
 
-def build_albums(path, recursive=False):
-    """Provides an iterable of Albums based on a path
 
-    build_albums provides an optional parameter: recursive.
-    If recursive is set to True, Albums will be created from
-    the given path, as well as any subdirectories. The
-    default is False, and so only one Album is created for
-    the iterable result.
+def _parse_song_file(path, statistics, scan=False):
+    """Parses a file once, returning None if it is not audio
+
+    Returns the mutagen file and the bytes read. With scan, only the
+    regions of the file holding tags are read (see library.scan.read_tags)
+    and counted; otherwise the bytes read are None.
     """
-    def prep_album(files, path):
-        """An attempt to keep code affecting the build of an Album"""
-        paths = [os.path.join(path, x) for x in files]
-        tracks = [Track(x) for x in paths if os.path.isfile(x) and File(x)]
+    try:
+        if scan:
+            song_file, bytes_read = read_tags(path)
+        else:
+            song_file, bytes_read = File(path, easy=True), None
+    except (IOError, OSError, MutagenError):
+        return None, None
+
+    statistics['parsed'] += 1
+    if bytes_read is not None:
+        statistics['bytes'] += bytes_read
+    return song_file, bytes_read
+
 
-        if not tracks:
+def _parsed_track(path, song_file, bytes_read, stat=None):
+    """Builds a Track around a file parsed for a scan"""
+    track = Track(path, song_file=song_file, stat=stat)
+    track.bytes_read = bytes_read
+    return track
+
+
+def _scan_track(path, statistics, index=None, scan=False, lazy=False):
+    """Builds the Track at path for a scan, or None if it is not audio
+
+    Given a TagIndex, files with an unchanged signature are built from
+    the index without being opened, and anything parsed is indexed.
+    With lazy and no index, files are not parsed but only stat'ed, and
+    their Tracks are lazy (see Track). Files missing from an index are
+    always parsed, so that the index fills.
+    """
+    if index is None and not lazy:
+        song_file, bytes_read = _parse_song_file(path, statistics, scan)
+        if song_file is None:
             return None
+        return _parsed_track(path, song_file, bytes_read)
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    if not S_ISREG(stat.st_mode):
+        return None
+
+    if index is not None:
+        signature = file_signature(stat)
+        cached = index.lookup(path, signature)
+        if cached is not None:
+            statistics['cached'] += 1
+            return Track(path, cached=cached, stat=stat) if cached else None
 
-        album = Album(tracks)
-        set_album_path(album, path)
+    if index is None:
+        return Track(path, lazy=True, stat=stat)
 
+    song_file, bytes_read = _parse_song_file(path, statistics, scan)
+    track = None
+    if song_file is not None:
+        track = _parsed_track(path, song_file, bytes_read, stat)
+    index.store(path, signature, track)
+
+    return track
+
+
+def _prep_album(files, path, statistics, index=None, scan=False,
+                lazy=False):
+    """Builds an Album from the supported files in a directory
+
+    Each file is opened and parsed at most once, and the parsed file is
+    handed on to its Track. Returns None if none of the files are
+    supported tracks. With lazy, no file is parsed, and the fields of
+    the Album are found when first used (see Album).
+    """
+    tracks = []
+    for name in files:
+        track = _scan_track(os.path.join(path, name), statistics, index,
+                            scan, lazy)
+
+        if track is not None:
+            tracks.append(track)
+
+    statistics['tracks'] += len(tracks)
+
+    if index is not None:
+        index.commit()
+
+    if not tracks:
+        return None
+
+    album = Album(tracks, lazy=lazy)
+    set_album_path(album, path)
+
+    if not lazy:
         for field, shared_value in find_shared_tags(album).items():
             setattr(album, field, shared_value)
 
-        return album
+    return album
+
+
+def _worker_index(path):
+    """Opens the TagIndex at path once per process"""
+    index = _worker_indexes.get(path)
+
+    if index is None:
+        index = TagIndex(path)
+        _worker_indexes[path] = index
+
+    return index
+
+
+def _record_directory(index, path, album, started, stat=None):
+    """Records the signature of a directory built through a TagIndex
+
+    Directories modified just before started are recorded as changed,
+    as a later change within the same mtime tick could not be detected.
+    """
+    if stat is None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+    signature = directory_signature(stat)
+    if stat.st_mtime >= started - _RACY_SECONDS:
+        signature = None
+
+    index.store_directory(path, signature, bool(album))
+
+
+def _prep_walked_album(task):
+    """Pool friendly wrapper over _prep_album for scan.walk entries
+
+    Takes a scan.walk entry, the path of a TagIndex (or None), whether
+    to scan and be lazy, and the time the build started if directories
+    are to be recorded in the index. Returns the Album along with the
+    statistics gathered in the worker.
+    """
+    (root, files), index_path, scan, lazy, started = task
+    index = _worker_index(index_path) if index_path else None
+    statistics = Counter()
+    album = _prep_album(files, root, statistics, index, scan, lazy)
+
+    if started is not None:
+        _record_directory(index, root, album, started)
+        index.commit()
+
+    return album, statistics
+
+
+def build_albums(path, recursive=False, workers=None, index=None,
+                 extensions=AUDIO_EXTENSIONS, scan=False, lazy=False):
+    """Provides an iterable of Albums based on a path
+
+    build_albums provides an optional parameter: recursive.
+    If recursive is set to True, Albums will be created from
+    the given path, as well as any subdirectories. The
+    default is False, and so only one Album is created for
+    the iterable result.
+
+    A recursive build may also be given a number of workers, in which
+    case directories are parsed concurrently by a pool of that many
+    processes (0 sizes the pool to the number of cores). Albums are
+    still yielded in the order that the directories are walked. The
+    default, None, parses each directory serially.
+
+    Given a TagIndex, Tracks for files that have not changed since they
+    were indexed are built from the index instead of being parsed, and
+    the index is updated with any files that were parsed.
+
+    Only files with one of the given extensions, or with an unknown
+    extension and the leading bytes of an audio file, are parsed (see
+    library.scan). Cover art, cue sheets and logs are never opened.
+
+    Progress of the current build is kept in scan_statistics, which
+    counts the files 'parsed', the 'cached' files read from the index
+    and the 'tracks' built from them. With scan, files are parsed in
+    scan mode (see build_track): each parsed Track keeps the bytes read
+    from its file as bytes_read, and their total is counted as 'bytes'.
+
+    With lazy, nothing is parsed: each listed file is only stat'ed, and
+    becomes a lazy Track keeping its stat result, which parses the file
+    when its tags are first used (see Track). Album fields are likewise
+    read when first used. Given a TagIndex as well, unchanged files are
+    built from it, and files missing from it are parsed and indexed.
+
+    A recursive build through a TagIndex with the default extensions
+    also records the signature of each directory, as rescan_albums does,
+    so that a later rescan or refresh only visits what changed since.
+    """
+    scan_statistics.clear()
+    started = None
+    if index is not None and extensions == AUDIO_EXTENSIONS:
+        started = time.time()
 
     if recursive is False:
-        album = prep_album(os.listdir(path), path)
+        _, files = list_directory(path, extensions)
+        album = _prep_album(files, path, scan_statistics, index, scan,
+                            lazy)
 
         if not album:
             raise NoFileFoundError("No supported tracks at {}".format(path))
 
         yield album
 
-    else:
-        for root, _, files in os.walk(path):
-            album = prep_album(files, root)
+    elif workers is None:
+        for root, files in walk(path, extensions):
+            album = _prep_album(files, root, scan_statistics, index, scan,
+                                lazy)
+
+            if started is not None:
+                _record_directory(index, root, album, started)
+                index.commit()
 
             if not album:
                 continue
 
             yield album
 
+    else:
+        index_path = index.path if index is not None else None
+        tasks = ((walked, index_path, scan, lazy, started)
+                 for walked in walk(path, extensions))
 
-def find_shared_tags(*albums):
-    """Finds field shared by all tracks on a given album
-    Returns a dictionary mapping of fields to shared values.
+        pool = Pool(workers or None)
+        try:
+            for album, statistics in pool.imap(_prep_walked_album, tasks):
+                scan_statistics.update(statistics)
+
+                if not album:
+                    continue
+
+                yield album
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def _rescan(directories, index, forced=()):
+    """Yields AlbumDeltas from directories that changed or are forced
+
+    Used by rescan_albums and refresh_albums, see rescan_albums.
     """
-    try:
-        sample_track = albums[0][0]
-    except IndexError:
-        return None
+    scan_statistics.clear()
+    started = time.time()
+    pending = list(reversed(directories))
+    visited = set()
+
+    while pending:
+        directory = pending.pop()
+        if directory in visited:
+            continue
+        visited.add(directory)
+
+        recorded = index.lookup_directory(directory)
+
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            stat = None
+
+        if stat is None or not S_ISDIR(stat.st_mode):
+            for removed in index.remove_directory(directory):
+                yield AlbumDelta('removed', removed, None)
+            index.commit()
+            continue
+
+        signature = directory_signature(stat)
+        if (directory not in forced and recorded is not None and
+                recorded[0] == signature):
+            scan_statistics['skipped'] += 1
+            pending.extend(reversed(index.child_directories(directory)))
+            continue
+
+        subdirs, files = list_directory(directory)
+        cached = scan_statistics['cached']
+        album = _prep_album(files, directory, scan_statistics, index)
+        had_album = recorded is not None and recorded[1]
+
+        # Files not read from the index were added or changed
+        pruned = index.prune_directory(directory, files)
+        changed = pruned or scan_statistics['cached'] - cached < len(files)
+
+        if album and not had_album:
+            yield AlbumDelta('added', directory, album)
+        elif album and changed:
+            yield AlbumDelta('changed', directory, album)
+        elif had_album and not album:
+            yield AlbumDelta('removed', directory, None)
+
+        existing = set(subdirs)
+        for child in index.child_directories(directory):
+            if child not in existing:
+                for removed in index.remove_directory(child):
+                    yield AlbumDelta('removed', removed, None)
+
+        _record_directory(index, directory, album, started, stat)
+        index.commit()
+        pending.extend(reversed(subdirs))
+
+
+def rescan_albums(path, index):
+    """Yields an AlbumDelta for each album that changed since the last rescan
+
+    Each directory's signature (see library.index.directory_signature)
+    is recorded in the TagIndex. Directories whose signature is unchanged
+    are not listed again, and only their recorded subdirectories are
+    visited. Changed directories are rebuilt through the index, so only
+    the files in them that changed are parsed.
+
+    Each AlbumDelta gives a status of 'added', 'changed' or 'removed',
+    the path of the album and the rebuilt Album (None when removed). An
+    album is only 'changed' if files in its directory were added,
+    changed or removed, not if only its subdirectories were, and the
+    index forgets files that were removed. Directories are only listed
+    again when an entry in them is added, removed or renamed: a file
+    edited in place is picked up by build_albums with the same index,
+    or by refresh_albums.
+
+    Directories modified just before the rescan are recorded as changed,
+    as a later change within the same mtime tick could not be detected.
+    """
+    return _rescan([os.path.abspath(path)], index)
+
+
+def refresh_albums(paths, index):
+    """Yields an AlbumDelta for each album changed in the given directories
+
+    The directories are listed and rebuilt through the TagIndex whether
+    or not their signature changed, which picks up files edited in place
+    (eg. as reported by library.watcher). Their subdirectories are then
+    rescanned as in rescan_albums.
+    """
+    directories = sorted(set(os.path.abspath(x) for x in paths))
+    return _rescan(directories, index, forced=set(directories))
+
+
+class SharedTags(object):
+    """Collects the fields shared by every track fed to it
+
+    Tracks may be added and removed a few at a time (eg. as a selection
+    grows or shrinks), and every field of each is read once, when it is
+    added. To find the fields of a fixed set of tracks, find_shared_tags
+    reads fewer. The values of a track are kept as they were when it was
+    added, so a track changed since should be removed and added again.
+    """
+
+    def __init__(self):
+        self._fed = {}
+        self._counts = {}
+
+    def __contains__(self, track):
+        return id(track) in self._fed
 
-    def is_shared(field, albums):
-        """Determines if a given field is the same in all given albums"""
-        result = set()
+    def add(self, *albums):
+        """Feeds the tracks of any number of Albums (or lists of Tracks)"""
         for album in albums:
             for track in album:
-                result.add(getattr(track, field))
+                self.add_track(track)
 
-        return len(result) == 1
+    def remove(self, *albums):
+        """Forgets the tracks of any number of Albums (or lists of Tracks)"""
+        for album in albums:
+            for track in album:
+                self.remove_track(track)
+
+    def add_track(self, track):
+        """Feeds a single Track, unless it was already fed"""
+        if track in self:
+            return
+
+        values = {field: getattr(track, field)
+                  for field in track.supported_fields()}
+        self._fed[id(track)] = values
+        for field, value in values.items():
+            self._counts.setdefault(field, Counter())[value] += 1
+
+    def remove_track(self, track):
+        """Forgets a single Track, if it was fed"""
+        values = self._fed.pop(id(track), None)
+        if values is None:
+            return
+
+        for field, value in values.items():
+            counts = self._counts[field]
+            counts[value] -= 1
+            if not counts[value]:
+                del counts[value]
+
+    def result(self):
+        """Returns a dict of the shared fields, or None if given no tracks"""
+        if not self._fed:
+            return None
 
-    album = albums[0]
-    result = {}
-    for field in sample_track.supported_fields():
-        if is_shared(field, albums):
-            result[field] = getattr(album.tracks[0], field)
+        return {field: next(iter(counts))
+                for field, counts in self._counts.items()
+                if len(counts) == 1}
+
+
+def find_shared_tags(*albums):
+    """Finds field shared by all tracks on a given album
+    Returns a dictionary mapping of fields to shared values.
+
+    A field is no longer read from later tracks once two tracks have
+    disagreed on it (see SharedTags for a selection that changes).
+    """
+    shared = None
+    for album in albums:
+        for track in album:
+            if shared is None:
+                shared = {field: getattr(track, field)
+                          for field in track.supported_fields()}
+                continue
 
-    return result
+            for field, value in shared.items():
+                if getattr(track, field) != value:
+                    del shared[field]
 
+            if not shared:
+                return shared
 
-def retag_album(album, mapping):
+    return shared
+
+
+def retag_album(album, mapping, commit=True):
     """Uses information from a mapping to update the tags of a given Album
 
     Changes the tags of an Album and all contained tracks based on
     a mapping (eg. dict). Mappings not found in the track's supported
     fields will raise a NotImplementedError exception.
 
+    A 'tracks' mapping gives one source per track of the album, in order,
+    whose fields are copied to that track (see get_fields).
+
+    Changes are staged on the tracks, and each track is then saved once
+    (see commit_tracks). If commit is False, the changes are only staged.
     """
+    track_mapping = {}
     for name, field in mapping.items():
         if name in album.supported_fields():
             setattr(album, name, field)
-        elif name == 'tracks':
-            for track in album:
-                retag_track(track, get_fields(mapping))
+
+        if name == 'tracks':
+            for track, source in zip(album, field):
+                retag_track(track, get_fields(source), commit=False)
+        else:
+            track_mapping[name] = field
 
     for track in album:
-        retag_track(track, mapping)
+        retag_track(track, track_mapping, commit=False)
+
+    if commit:
+        commit_tracks(album)
 
 
-def retag_track(track, mapping):
+def retag_track(track, mapping, commit=True):
     """Uses information from a mapping to update the tags of a given Track
 
     Changes the tags of a Track based on a mapping (eg. dict). Mappings
     not found in the track's supported fields will raise a
     NotImplementedError exception.
+
+    If commit is False, the changes are staged but not saved to disk.
     """
     for name, field in mapping.items():
         if name in track.supported_fields():
@@ -170,7 +622,225 @@ def retag_track(track, mapping):
         else:
             raise NotImplementedError("Unsupported field: {}".format(field))
 
-    track()  # Saves updates to disk
+    if commit:
+        track()  # Saves updates to disk
+
+
+def _save_track(track):
+    return track()
+
+
+def commit_tracks(tracks, workers=None):
+    """Saves the staged changes of tracks, writing each file once
+
+    A track given more than once is still only saved once, and tracks
+    without changes are not written at all. If workers is given, files
+    are saved concurrently by a pool of that many threads (0 sizes the
+    pool to the number of cores).
+
+    Returns the number of files written.
+    """
+    unique = OrderedDict((id(x), x) for x in tracks).values()
+
+    if workers is None:
+        return sum(1 for x in unique if _save_track(x))
+
+    pool = ThreadPool(workers or None)
+    try:
+        return sum(1 for x in pool.map(_save_track, unique) if x)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _fingerprint_path(task):
+    """Fingerprints the file at a path, in a fingerprint_albums worker
+
+    Takes the path and that of a FingerprintCache (or None), which is
+    opened once per process. Returns the path, its fingerprint (None if
+    the file could not be fingerprinted) and any other error raised, to
+    be raised again by fingerprint_albums.
+    """
+    path, cache_path = task
+
+    try:
+        if cache_path is not None:
+            cache = _worker_fingerprints.get(cache_path)
+            if cache is None:
+                cache = FingerprintCache(cache_path)
+                _worker_fingerprints[cache_path] = cache
+            Track.fingerprint_cache = cache
+
+        return path, Track(path, lazy=True).fingerprint, None
+    except acoustid.FingerprintGenerationError:
+        return path, None, None
+    except Exception as error:
+        return path, None, error
+
+
+def fingerprint_albums(albums, workers=0):
+    """Yields (track, fingerprint) for each Track of albums
+
+    Fingerprinting decodes each file, so the tracks are spread over a
+    pool of workers processes, by default sized to the number of cores
+    (0). albums may be any iterable of Albums, such as build_albums
+    output, and is read only a few tracks per worker ahead of the
+    results. Results are yielded as they finish, with each track's
+    fingerprint filled in. Given None workers, each track is
+    fingerprinted in turn instead.
+
+    Tracks already fingerprinted are yielded as they are, and a
+    fingerprint of None is yielded for a file that could not be
+    fingerprinted. The workers use Track.fingerprint_cache, if set,
+    through their own connections to it.
+    """
+    if workers is None:
+        for album in albums:
+            for track in album:
+                try:
+                    yield track, track.fingerprint
+                except acoustid.FingerprintGenerationError:
+                    yield track, None
+        return
+
+    cache = Track.fingerprint_cache
+    cache_path = cache.path if cache is not None else None
+
+    pool = Pool(workers or None)
+    limit = 4 * (workers or cpu_count())
+
+    # The tracks of each path in flight, and the results as they finish
+    # (put there by the pool's result handler thread)
+    waiting = {}
+    finished = Queue()
+
+    def collect():
+        path, fingerprint, error = finished.get()
+        if error is not None:
+            raise error
+
+        for track in waiting.pop(path):
+            if fingerprint is not None:
+                track._fingerprint = fingerprint
+            yield track, fingerprint
+
+    try:
+        for album in albums:
+            for track in album:
+                if track._fingerprint:
+                    yield track, track._fingerprint
+                elif track.path in waiting:
+                    waiting[track.path].append(track)
+                else:
+                    waiting[track.path] = [track]
+                    pool.apply_async(_fingerprint_path,
+                                     ((track.path, cache_path),),
+                                     callback=finished.put)
+
+                while len(waiting) > limit:
+                    for result in collect():
+                        yield result
+
+        while waiting:
+            for result in collect():
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _content_hash(track):
+    return track.content_hash
+
+
+def _hash_tracks(tracks, workers):
+    """Computes the content hash of each track, on threads if given workers"""
+    if workers is None:
+        return map(_content_hash, tracks)
+
+    pool = ThreadPool(workers or None)
+    try:
+        return pool.map(_content_hash, tracks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def find_duplicates(albums, workers=None, index=None):
+    """Returns lists of the tracks of albums that carry the same audio
+
+    Tracks are compared by content hash, so copies of a file are found
+    however they are tagged or named. Identical audio has the same
+    length, so only tracks sharing their length with another are hashed.
+    Given workers, files are hashed by a pool of that many threads (0
+    sizes the pool to the number of cores). Given a TagIndex, hashes are
+    recorded there, and read back for files that have not changed.
+
+    Each list holds the tracks of one recording, ordered by path, and
+    the lists are ordered by the path of their first track.
+    """
+    by_length = {}
+    seen = set()
+    for album in albums:
+        for track in album:
+            if track.path not in seen:
+                seen.add(track.path)
+                by_length.setdefault(track.length, []).append(track)
+
+    candidates = [x for tracks in by_length.values() if len(tracks) > 1
+                  for x in tracks]
+
+    groups = {}
+    for track, content_hash in zip(candidates,
+                                   _hash_tracks(candidates, workers)):
+        groups.setdefault(content_hash, []).append(track)
+        if index is not None:
+            index.store_hash(track.path, content_hash)
+
+    if index is not None:
+        index.commit()
+
+    duplicates = [sorted(x, key=lambda track: track.path)
+                  for x in groups.values() if len(x) > 1]
+    return sorted(duplicates, key=lambda x: x[0].path)
+
+
+def find_near_duplicates(albums, workers=None, threshold=None):
+    """Returns lists of the tracks of albums that sound alike
+
+    Unlike find_duplicates, this finds a recording whatever its encoding
+    (eg. ripped at two bitrates), by fingerprinting every track as in
+    fingerprint_albums and comparing the fingerprints with a
+    library.similarity.FingerprintIndex, which requires NumPy.
+    """
+    from r3tagger.library.similarity import FingerprintIndex
+
+    index = FingerprintIndex()
+    for track, fingerprint in fingerprint_albums(albums, workers):
+        if fingerprint:
+            index.add(track, fingerprint)
+
+    clusters = [sorted(x, key=lambda track: track.path)
+                for x in index.clusters(threshold)]
+    return sorted(clusters, key=lambda x: x[0].path)
+
+
+def audio_changed(tracks, index):
+    """Returns the tracks whose audio differs from that recorded in index
+
+    Tracks whose hash has not been recorded before are not counted as
+    changed. The hash of every track is recorded for the next call, so a
+    track retagged since is hashed again, but one unchanged is not.
+    """
+    changed = []
+    for track in tracks:
+        recorded = index.recorded_hash(track.path)
+        if recorded is not None and recorded != track.content_hash:
+            changed.append(track)
+        index.store_hash(track.path, track.content_hash)
+
+    index.commit()
+    return changed
 
 
 def missing_fields(target):
@@ -227,15 +897,18 @@ def album_from_tracks(tracks, name=None):
 def flush_changes(*tracks_or_albums):
     """Flushes the changes made to given tracks and/or albums to disk
 
-    Accepts any number of Track and/or Album objects
+    Accepts any number of Track and/or Album objects. Tracks without
+    changes are skipped. Returns the number of files written.
     """
+    tracks = []
     for item in tracks_or_albums:
         if isinstance(item, Album):
-            for track in item:
-                track()
+            tracks.extend(item)
 
         else:
-            item()
+            tracks.append(item)
+
+    return commit_tracks(tracks)
 
 
 def tags_by_frequency(album, field):
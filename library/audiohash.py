@@ -0,0 +1,196 @@
+"""r3tagger.library.audiohash
+
+Hashes the audio of a file while leaving out its tags, so that two
+files carrying the same audio hash alike however they are tagged, and
+retagging a file never changes its hash.
+
+Left out of the hash are:
+    ID3v2 tags at the start of a file, and ID3v1 and APEv2 tags at its end
+    FLAC metadata blocks (including Vorbis comments and pictures)
+    Ogg pages holding the stream headers (including Vorbis comments),
+    and the page headers of every page, which are renumbered on retagging
+    Every MP4 box but the media data ('mdat')
+
+The file is read sequentially in large chunks, in bounded memory.
+
+Provides Functions:
+    audio_hash(path:str)
+    Returns the hex SHA-1 of the audio in a file
+"""
+
+import os
+import struct
+import hashlib
+
+
+# Size of each read from the file
+CHUNK_SIZE = 1 << 20
+
+_ID3V1_SIZE = 128
+_APE_FOOTER_SIZE = 32
+
+
+def _syncsafe(data):
+    """Decodes the 28 bit integer of an ID3v2 header"""
+    value = 0
+    for byte in bytearray(data):
+        value = (value << 7) | (byte & 0x7f)
+
+    return value
+
+
+def _skip_id3v2(audio, start):
+    """Returns the offset following any ID3v2 tags from start"""
+    while True:
+        audio.seek(start)
+        header = audio.read(10)
+        if len(header) < 10 or header[:3] != 'ID3':
+            return start
+
+        size = 10 + _syncsafe(header[6:10])
+        if ord(header[5]) & 0x10:
+            size += 10  # Footer
+        start += size
+
+
+def _trim_tail(audio, start, end):
+    """Returns the offset of any ID3v1 and APEv2 tags at the end of a file"""
+    if end - start >= _ID3V1_SIZE:
+        audio.seek(end - _ID3V1_SIZE)
+        if audio.read(3) == 'TAG':
+            end -= _ID3V1_SIZE
+
+    if end - start >= _APE_FOOTER_SIZE:
+        audio.seek(end - _APE_FOOTER_SIZE)
+        footer = audio.read(_APE_FOOTER_SIZE)
+        if footer[:8] == 'APETAGEX':
+            size, _, flags = struct.unpack('<III', footer[12:24])
+            if flags & 0x80000000:
+                size += _APE_FOOTER_SIZE  # Header
+            end = max(start, end - size)
+
+    return end
+
+
+def _hash_range(audio, digest, start, end):
+    """Adds the bytes of a file from start up to end to digest"""
+    audio.seek(start)
+    remaining = end - start
+
+    while remaining > 0:
+        chunk = audio.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+
+
+def _hash_flac(audio, digest, start, end):
+    """Hashes the frames of a FLAC stream, after its metadata blocks"""
+    position = start + 4  # 'fLaC'
+
+    while position < end:
+        audio.seek(position)
+        header = audio.read(4)
+        if len(header) < 4:
+            break
+
+        position += 4 + struct.unpack('>I', '\x00' + header[1:])[0]
+        if ord(header[0]) & 0x80:  # Last metadata block
+            break
+
+    _hash_range(audio, digest, position, end)
+
+
+def _hash_ogg(audio, digest, start, end):
+    """Hashes the packet data of each Ogg page past the stream headers
+
+    Pages ending a header packet have a granule position of 0, while
+    those ending an audio packet have a position past 0. Pages on which
+    no packet ends (-1) belong with the packets that follow them, so are
+    only hashed once a page of audio shows them to be audio. Returns the
+    digest, which may have been replaced.
+    """
+    audio.seek(start)
+    position = start
+    pending = None
+    started = False
+
+    while position + 27 <= end:
+        header = audio.read(27)
+        if len(header) < 27 or header[:4] != 'OggS':
+            break
+
+        granule = struct.unpack('<q', header[6:14])[0]
+        segments = bytearray(audio.read(ord(header[26])))
+        size = sum(segments)
+        data = audio.read(size)
+        position += 27 + len(segments) + size
+
+        if started:
+            digest.update(data)
+        elif granule == 0:
+            pending = None
+        elif granule == -1:
+            if pending is None:
+                pending = digest.copy()
+            pending.update(data)
+        else:
+            if pending is not None:
+                digest = pending
+            digest.update(data)
+            started = True
+
+    return digest
+
+
+def _hash_mp4(audio, digest, start, end):
+    """Hashes the contents of the media data boxes of an MP4 file"""
+    position = start
+
+    while position + 8 <= end:
+        audio.seek(position)
+        header = audio.read(8)
+        size, kind = struct.unpack('>I4s', header)
+        offset = 8
+
+        if size == 1:
+            size = struct.unpack('>Q', audio.read(8))[0]
+            offset = 16
+        elif size == 0:
+            size = end - position
+
+        if size < offset:
+            break
+
+        if kind == 'mdat':
+            _hash_range(audio, digest, position + offset, position + size)
+        position += size
+
+
+def audio_hash(path):
+    """Returns the hex SHA-1 of the audio in the file at path
+
+    Files of formats not recognised have everything but their ID3 and
+    APE tags hashed.
+    """
+    digest = hashlib.sha1()
+
+    with open(path, 'rb', CHUNK_SIZE) as audio:
+        size = os.fstat(audio.fileno()).st_size
+        start = _skip_id3v2(audio, 0)
+        end = _trim_tail(audio, start, size)
+
+        audio.seek(start)
+        head = audio.read(8)
+
+        if head[:4] == 'fLaC':
+            _hash_flac(audio, digest, start, end)
+        elif head[:4] == 'OggS':
+            digest = _hash_ogg(audio, digest, start, end)
+        elif head[4:8] == 'ftyp':
+            _hash_mp4(audio, digest, start, end)
+        else:
+            _hash_range(audio, digest, start, end)
+
+    return digest.hexdigest()
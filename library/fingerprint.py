@@ -0,0 +1,59 @@
+"""r3tagger.library.fingerprint
+
+Persistent cache of Acoustid fingerprints, so that a file's audio is only
+ever decoded to fingerprint it once.
+
+Fingerprints are keyed by the hash of a file's audio (see
+library.audiohash), not by its path or tags, so they survive retagging,
+renaming and moving files, and are shared by copies of the same audio.
+
+Provides Classes:
+    FingerprintCache(path:str)
+    Sqlite store of the duration and fingerprint of each audio hash
+"""
+
+import sqlite3
+
+
+class FingerprintCache(object):
+    """Sqlite backed cache of fingerprints keyed on audio hashes
+
+    As with TagIndex, the cache may be shared between processes by
+    opening a FingerprintCache on the same path in each of them, and may
+    be handed between threads but not used by two threads at once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            'audio_hash TEXT PRIMARY KEY, duration REAL, fingerprint TEXT)')
+        self._connection.commit()
+
+    def lookup(self, audio_hash):
+        """Returns the (duration, fingerprint) of audio_hash, or None"""
+        row = self._connection.execute(
+            'SELECT duration, fingerprint FROM fingerprints '
+            'WHERE audio_hash = ?', (audio_hash,)).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], str(row[1])
+
+    def store(self, audio_hash, duration, fingerprint):
+        """Records the duration and fingerprint of audio_hash"""
+        self._connection.execute(
+            'INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)',
+            (audio_hash, duration, fingerprint))
+        self._connection.commit()
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+
+    def close(self):
+        self._connection.close()
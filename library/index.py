@@ -0,0 +1,290 @@
+"""r3tagger.library.index
+
+Persistent index of the tags found in a music collection, so that
+unchanged files need not be parsed again between scans.
+
+Provides Functions:
+    file_signature(stat:os.stat_result)
+    Returns the (size, mtime_ns, inode) used to detect a changed file
+
+    directory_signature(stat:os.stat_result)
+    Returns the (mtime_ns, nlink) used to detect a changed directory
+
+Provides Classes:
+    TagIndex(path:str)
+    Sqlite store of Track fields, length, bitrate and audio hash keyed
+    on the path and signature of each file, and of the directories last
+    scanned
+"""
+
+import os
+import sqlite3
+
+from r3tagger.model.track import Track
+
+
+def _mtime_ns(stat):
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 1000000000)
+
+    return mtime_ns
+
+
+def file_signature(stat):
+    """Returns the (size, mtime_ns, inode) signature of a stat result
+
+    If any of the three differ from those recorded for a path, the file
+    is taken to have changed since it was indexed.
+    """
+    return (stat.st_size, _mtime_ns(stat), stat.st_ino)
+
+
+def directory_signature(stat):
+    """Returns the (mtime_ns, nlink) signature of a directory's stat result
+
+    A directory's mtime changes whenever an entry is added, removed or
+    renamed in it, and its link count follows its number of
+    subdirectories, so neither requires listing the directory.
+    """
+    return (_mtime_ns(stat), stat.st_nlink)
+
+
+def _path_bytes(path):
+    path = os.path.abspath(path)
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+
+    return path
+
+
+def _path_key(path):
+    """Paths are stored as bytes so any file name can be indexed"""
+    return sqlite3.Binary(_path_bytes(path))
+
+
+def _subtree_keys(path):
+    """Returns the bounds of the keys of every path below path"""
+    path = _path_bytes(path)
+    return (sqlite3.Binary(path + os.sep),
+            sqlite3.Binary(path + chr(ord(os.sep) + 1)))
+
+
+class TagIndex(object):
+    """Sqlite backed index of the tags of files in a collection
+
+    Each indexed file records its signature (see file_signature) along
+    with the Track's supported fields, length and bitrate. Files that are
+    not audio are recorded as well, so they are not parsed again either.
+
+    Directories are recorded with their signature (see
+    directory_signature), their parent and whether they held an Album,
+    which allows unchanged parts of a collection to be skipped.
+
+    The index may be shared between processes by opening a TagIndex on
+    the same path in each of them. A TagIndex may be handed from one
+    thread to another, but must not be used by two threads at once.
+    """
+
+    _info_fields = ('length', 'bitrate')
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+
+    def _create_tables(self):
+        fields = ', '.join('{} TEXT'.format(x)
+                           for x in Track.supported_fields())
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS tracks ('
+            'path BLOB PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+            'inode INTEGER, audio INTEGER, {}, length REAL, '
+            'bitrate INTEGER, audio_hash TEXT, hashed INTEGER, '
+            'directory BLOB)'.format(fields))
+        self._add_missing_columns()
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS track_directories '
+            'ON tracks (directory)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS directories ('
+            'path BLOB PRIMARY KEY, parent BLOB, mtime_ns INTEGER, '
+            'nlink INTEGER, album INTEGER)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS directory_parents '
+            'ON directories (parent)')
+        self._connection.commit()
+
+    def _add_missing_columns(self):
+        """Upgrades a tracks table made by an earlier version"""
+        columns = set(x[1] for x in self._connection.execute(
+            'PRAGMA table_info(tracks)'))
+        for column, kind in (('audio_hash', 'TEXT'), ('hashed', 'INTEGER'),
+                             ('directory', 'BLOB')):
+            if column not in columns:
+                self._connection.execute(
+                    'ALTER TABLE tracks ADD COLUMN {} {}'.format(column, kind))
+
+    def lookup(self, path, signature):
+        """Returns the indexed values for path if its signature matches
+
+        The result is None if the file is not indexed or has changed. A
+        file known not to be audio gives an empty dict, otherwise the
+        dict maps the supported fields, 'length' and 'bitrate' to values,
+        and 'audio_hash' to the file's audio hash if it has been recorded.
+        """
+        columns = Track.supported_fields() + self._info_fields
+        query = ('SELECT size, mtime_ns, inode, audio, hashed, audio_hash, '
+                 '{} FROM tracks WHERE path = ?'.format(', '.join(columns)))
+        row = self._connection.execute(query, (_path_key(path),)).fetchone()
+
+        if row is None or tuple(row[:3]) != tuple(signature):
+            return None
+
+        if not row[3]:
+            return {}
+
+        values = dict(zip(columns, row[6:]))
+        if row[4]:
+            values['audio_hash'] = str(row[5])
+
+        return values
+
+    def store(self, path, signature, track=None):
+        """Records the values of track, or no track if path is not audio
+
+        The audio hash of track is recorded if it has been computed.
+        Otherwise the hash recorded before is kept (see recorded_hash),
+        but is no longer looked up as that of the file.
+        """
+        columns = Track.supported_fields() + self._info_fields
+        content_hash = None
+        if track is None:
+            values = (None,) * len(columns)
+        else:
+            values = tuple(getattr(track, x) for x in columns)
+            content_hash = track.__dict__.get('_content_hash')
+
+        key = _path_key(path)
+        directory = _path_key(os.path.dirname(_path_bytes(path)))
+        query = ('INSERT OR REPLACE INTO tracks '
+                 '(path, size, mtime_ns, inode, audio, hashed, audio_hash, '
+                 'directory, {}) VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, '
+                 '(SELECT audio_hash FROM tracks WHERE path = ?)), ?, {})'
+                 .format(', '.join(columns), ', '.join('?' * len(columns))))
+        row = ((key,) + tuple(signature) +
+               (track is not None, content_hash is not None, content_hash,
+                key, directory) + values)
+        self._connection.execute(query, row)
+
+    def prune_directory(self, path, names):
+        """Forgets the files indexed in a directory that are not in names
+
+        Only files directly within the directory are considered. Returns
+        the number of files forgotten.
+        """
+        rows = self._connection.execute(
+            'SELECT path FROM tracks WHERE directory = ?', (_path_key(path),))
+        listed = set(_path_bytes(os.path.join(path, x)) for x in names)
+        stale = [(x[0],) for x in rows if str(x[0]) not in listed]
+
+        self._connection.executemany('DELETE FROM tracks WHERE path = ?',
+                                     stale)
+        return len(stale)
+
+    def store_hash(self, path, audio_hash):
+        """Records the audio hash of the file indexed at path"""
+        self._connection.execute(
+            'UPDATE tracks SET audio_hash = ?, hashed = 1 WHERE path = ?',
+            (audio_hash, _path_key(path)))
+
+    def recorded_hash(self, path):
+        """Returns the audio hash last recorded for path, or None
+
+        Unlike lookup, this is the hash recorded whether or not the file
+        has changed since, for telling whether its audio has changed.
+        """
+        row = self._connection.execute(
+            'SELECT audio_hash FROM tracks WHERE path = ?',
+            (_path_key(path),)).fetchone()
+
+        if row is None or row[0] is None:
+            return None
+
+        return str(row[0])
+
+    def remove(self, path):
+        """Forgets the indexed values for path"""
+        self._connection.execute('DELETE FROM tracks WHERE path = ?',
+                                 (_path_key(path),))
+
+    def lookup_directory(self, path):
+        """Returns the (signature, album) recorded for a directory
+
+        The result is None if the directory has not been recorded. album
+        is True if the directory held an Album when it was recorded.
+        """
+        row = self._connection.execute(
+            'SELECT mtime_ns, nlink, album FROM directories '
+            'WHERE path = ?', (_path_key(path),)).fetchone()
+
+        if row is None:
+            return None
+
+        return (tuple(row[:2]), bool(row[2]))
+
+    def store_directory(self, path, signature, album):
+        """Records a scanned directory and whether it held an Album
+
+        A signature of None records the directory such that it is taken
+        to have changed when it is next looked up.
+        """
+        if signature is None:
+            signature = (None, None)
+
+        parent = os.path.dirname(os.path.abspath(path))
+        self._connection.execute(
+            'INSERT OR REPLACE INTO directories '
+            '(path, parent, mtime_ns, nlink, album) VALUES (?, ?, ?, ?, ?)',
+            (_path_key(path), _path_key(parent)) + tuple(signature) +
+            (album,))
+
+    def child_directories(self, path):
+        """Returns the recorded subdirectories of a directory"""
+        rows = self._connection.execute(
+            'SELECT path FROM directories WHERE parent = ? ORDER BY path',
+            (_path_key(path),))
+
+        return [str(x[0]) for x in rows]
+
+    def remove_directory(self, path):
+        """Forgets a directory and everything recorded beneath it
+
+        Returns the paths of the removed directories that held Albums.
+        """
+        low, high = _subtree_keys(path)
+        subtree = '(path = ? OR (path >= ? AND path < ?))'
+        keys = (_path_key(path), low, high)
+
+        rows = self._connection.execute(
+            'SELECT path FROM directories WHERE album AND {} '
+            'ORDER BY path'.format(subtree), keys)
+        albums = [str(x[0]) for x in rows]
+
+        self._connection.execute(
+            'DELETE FROM directories WHERE {}'.format(subtree), keys)
+        self._connection.execute(
+            'DELETE FROM tracks WHERE path >= ? AND path < ?', (low, high))
+
+        return albums
+
+    def commit(self):
+        """Writes stored changes to disk"""
+        self._connection.commit()
+
+    def close(self):
+        """Commits and closes the index"""
+        self._connection.commit()
+        self._connection.close()
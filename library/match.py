@@ -0,0 +1,207 @@
+"""r3tagger.library.match
+
+Scores the similarity of Albums, for ranking the candidate releases
+found for a local album. Strings are normalized once (case folded, with
+diacritics and punctuation removed) and broken into trigrams, and the
+result is cached, so that each comparison is mostly set arithmetic.
+
+Provides Functions:
+    normalize(value:unicode)
+    Case folds a value and strips its diacritics and punctuation
+
+    similarity(album:Album, other:Album)
+    Rates the similarity of two Albums in [0, 1]
+
+Provides Classes:
+    Matcher(album:Album, threshold=0.75:float)
+    Scores one Album against many candidates
+"""
+
+import re
+import unicodedata
+
+
+# Trigram similarity above which two differing values count as a match
+THRESHOLD = 0.75
+
+_PUNCTUATION = re.compile(r'[\W_]+', re.UNICODE)
+
+# Values repeat across albums and tracks, so each is normalized once. The
+# caches are cleared if they grow past this.
+_CACHE_LIMIT = 100000
+_normalized = {}
+_trigrams = {}
+
+
+def normalize(value):
+    """Returns value case folded, without diacritics or punctuation
+
+    Punctuation and runs of whitespace become a single space, so that
+    eg. u'Caf\\xe9 - Live!' and u'cafe live' normalize alike.
+    """
+    result = _normalized.get(value)
+
+    if result is None:
+        if len(_normalized) >= _CACHE_LIMIT:
+            _normalized.clear()
+
+        text = value
+        if not isinstance(text, unicode):
+            text = text.decode('utf-8', 'replace')
+
+        decomposed = unicodedata.normalize('NFKD', text)
+        stripped = u''.join(x for x in decomposed
+                            if not unicodedata.combining(x))
+        folded = stripped.lower().replace(u'\xdf', u'ss')
+        result = _PUNCTUATION.sub(u' ', folded).strip()
+
+        _normalized[value] = result
+
+    return result
+
+
+def _trigram_set(value):
+    """The trigrams of a normalized value, padded to include its ends"""
+    result = _trigrams.get(value)
+
+    if result is None:
+        if len(_trigrams) >= _CACHE_LIMIT:
+            _trigrams.clear()
+
+        padded = u'  {} '.format(value)
+        result = frozenset(padded[x:x + 3] for x in range(len(padded) - 2))
+        _trigrams[value] = result
+
+    return result
+
+
+def _trigram_similarity(value, other):
+    trigrams = _trigram_set(value)
+    other_trigrams = _trigram_set(other)
+    shared = len(trigrams & other_trigrams)
+
+    return float(shared) / (len(trigrams) + len(other_trigrams) - shared)
+
+
+def _track_title(track):
+    """The title of a Track, or the track itself if given as a string"""
+    if isinstance(track, basestring):
+        return track
+    return track.title
+
+
+def _normalized_album(album):
+    """The normalized fields and track titles of an Album
+
+    Returns ({field: value}, [titles]), leaving out empty values. The
+    result is cached on the Album until any of its values change.
+    """
+    raw = (tuple(getattr(album, x) for x in album.supported_fields()),
+           tuple(_track_title(x) for x in album.tracks if x))
+
+    cached = album.__dict__.get('_match_cache')
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+
+    fields = {}
+    for field, value in zip(album.supported_fields(), raw[0]):
+        if value:
+            normalized = normalize(value)
+            if normalized:
+                fields[field] = normalized
+
+    titles = [normalize(x) for x in raw[1]]
+    result = (fields, [x for x in titles if x])
+
+    album.__dict__['_match_cache'] = (raw, result)
+    return result
+
+
+def _values(normalized, other):
+    """The values compared between two normalized albums
+
+    As in Album.match, fields are only compared when both albums have
+    them, and titles only when both albums have tracks.
+    """
+    fields, titles = normalized
+    other_fields, other_titles = other
+
+    values = set(fields[x] for x in fields if x in other_fields)
+    other_values = set(other_fields[x] for x in other_fields if x in fields)
+
+    if titles and other_titles:
+        values.update(titles)
+        other_values.update(other_titles)
+
+    return values, other_values
+
+
+def _score(values, other_values, threshold):
+    """Jaccard similarity of two sets, counting near matches in part
+
+    Equal values count fully. Each remaining value may then be paired
+    with one remaining value of the other set whose trigram similarity
+    is at least threshold, counting for that similarity.
+    """
+    if not values and not other_values:
+        return 0.0
+
+    shared = values & other_values
+    matched = float(len(shared))
+
+    remaining = values - shared
+    other_remaining = other_values - shared
+    if remaining and other_remaining and threshold < 1:
+        pairs = []
+        for value in remaining:
+            for other in other_remaining:
+                score = _trigram_similarity(value, other)
+                if score >= threshold:
+                    pairs.append((score, value, other))
+
+        used = set()
+        for score, value, other in sorted(pairs, reverse=True):
+            if value not in used and other not in used:
+                used.update((value, other))
+                matched += score
+
+    return matched / (len(values) + len(other_values) - matched)
+
+
+class Matcher(object):
+    """Scores one Album against any number of candidate Albums
+
+    The Album is normalized once, however many candidates it is scored
+    against. Scores are as in similarity.
+    """
+
+    def __init__(self, album, threshold=THRESHOLD):
+        self.album = album
+        self.threshold = threshold
+        self._normalized = _normalized_album(album)
+
+    def score(self, candidate):
+        """Rates the similarity of a candidate Album in [0, 1]"""
+        values, other_values = _values(self._normalized,
+                                       _normalized_album(candidate))
+        return _score(values, other_values, self.threshold)
+
+    def scores(self, candidates):
+        """Scores of each candidate, in order"""
+        return [self.score(x) for x in candidates]
+
+    def rank(self, candidates):
+        """Returns (score, candidate) pairs, best first"""
+        scored = zip(self.scores(candidates), candidates)
+        return sorted(scored, key=lambda x: x[0], reverse=True)
+
+
+def similarity(album, other, threshold=THRESHOLD):
+    """Rates the similarity of two Albums in [0, 1]
+
+    The normalized values of the fields both Albums have, and of their
+    track titles (if both have tracks), are compared as sets: the score
+    is the size of their intersection over that of their union. Values
+    that differ only slightly (see THRESHOLD) count as partly shared.
+    """
+    return Matcher(album, threshold).score(other)
@@ -0,0 +1,133 @@
+"""r3tagger.library.pattern
+
+Naming patterns (eg. '{artist} - {tracknumber} - {title}', as set in
+r3tagger.cfg) compiled once into objects that name files from the fields
+of Tracks and Albums.
+
+Provides Functions:
+    sanitize(value:unicode)
+    Makes a field value safe to use within a file name
+
+    compile_pattern(pattern:str)
+    Returns the PathPattern for a pattern, compiling it only once
+
+Provides Classes:
+    PathPattern(pattern:str)
+    A pattern parsed once, that names files from the fields of a target
+"""
+
+import re
+from string import Formatter
+
+
+# Longest file name, in bytes, accepted by common filesystems
+MAX_NAME_BYTES = 255
+
+# Stands in for a name that is empty once formatted
+UNKNOWN = u'Unknown'
+
+# Path separators, NUL and control characters
+_UNSAFE = re.compile(u'[/\\\\\x00-\x1f\x7f]')
+
+# Values are repeated across many tracks (eg. artist and album names),
+# so each is sanitized once. The cache is cleared if it grows past this.
+_SANITIZED_LIMIT = 100000
+_sanitized = {}
+
+_patterns = {}
+
+
+def sanitize(value):
+    """Returns value with path separators and control characters replaced
+
+    Each is replaced with '_', surrounding whitespace is stripped, and a
+    value of '.' or '..' is replaced entirely. Results are cached.
+    """
+    result = _sanitized.get(value)
+
+    if result is None:
+        if len(_sanitized) >= _SANITIZED_LIMIT:
+            _sanitized.clear()
+
+        result = _UNSAFE.sub(u'_', value).strip()
+        if result in (u'.', u'..'):
+            result = u'_' * len(result)
+
+        _sanitized[value] = result
+
+    return result
+
+
+def _unicode(value):
+    if not isinstance(value, unicode):
+        value = unicode(value, 'utf-8', 'replace')
+
+    return value
+
+
+def _truncate(name, suffix):
+    """Shortens name so that name + suffix fits in MAX_NAME_BYTES"""
+    limit = MAX_NAME_BYTES - len(suffix.encode('utf-8'))
+    encoded = name.encode('utf-8')
+
+    if len(encoded) <= limit:
+        return name
+
+    return encoded[:limit].decode('utf-8', 'ignore').rstrip()
+
+
+class PathPattern(object):
+    """A naming pattern parsed once into its literal text and fields
+
+    Only the fields named in the pattern are read from a target, and each
+    value is sanitized (see sanitize) before being formatted with any
+    format spec or conversion of the pattern (eg. '{tracknumber:0>2}').
+    A name left empty (eg. '{album}' of an untagged album) is replaced
+    with UNKNOWN, so no part of a path is left empty.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._formatter = Formatter()
+        self._parts = list(self._formatter.parse(pattern))
+        self.fields = tuple(set(x[1] for x in self._parts if x[1]))
+
+    def format(self, target, suffix=u''):
+        """Names target (a Track or Album) after the pattern
+
+        A suffix (eg. the file extension, as unicode or UTF-8 bytes) is
+        appended, and the name is shortened to leave it whole within
+        MAX_NAME_BYTES.
+        """
+        values = {}
+        for field in self.fields:
+            value = getattr(target, field)
+            if value is None:
+                value = u''
+            values[field] = sanitize(_unicode(value))
+
+        pieces = []
+        for literal, field, spec, conversion in self._parts:
+            pieces.append(literal)
+            if field is not None:
+                value = values[field]
+                if conversion:
+                    value = self._formatter.convert_field(value, conversion)
+                pieces.append(format(value, spec))
+
+        name = u''.join(pieces)
+        if not name.strip():
+            name = UNKNOWN
+
+        suffix = _unicode(suffix)
+        return _truncate(name, suffix) + suffix
+
+
+def compile_pattern(pattern):
+    """Returns the PathPattern for pattern, compiled on first use"""
+    compiled = _patterns.get(pattern)
+
+    if compiled is None:
+        compiled = _patterns[pattern] = PathPattern(pattern)
+
+    return compiled
@@ -1,12 +1,19 @@
 import os
+import json
+import errno
 import shutil
-import tempfile
+import filecmp
+import threading
 import ConfigParser
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 from r3tagger import controller, FileExistsError
 from r3tagger.model.album import Album
 from r3tagger.model.track import Track
-from r3tagger.library import parent, extension
+from r3tagger.library import parent, extension, filename
+from r3tagger.library import transfer
+from r3tagger.library.pattern import compile_pattern
 
 # Config loading
 parent_dir = parent(os.path.dirname(__file__))
@@ -18,8 +25,24 @@ TRACK_PATTERN = config.get('Main', 'track-pattern')
 ALBUM_PATTERN = config.get('Main', 'album-pattern')
 COLLECTION_ROOT = config.get('Main', 'collection-root')
 ORGANIZATION_PATTERN = config.get('Main', 'organization-pattern')
-# TODO: Move to config file
-ARTIST_PATTERN = '{artist}'
+if config.has_option('Main', 'artist-pattern'):
+    ARTIST_PATTERN = config.get('Main', 'artist-pattern')
+else:
+    ARTIST_PATTERN = '{artist}'
+
+# A file to be moved, and the path it is to be moved to
+Move = namedtuple('Move', 'source destination')
+
+# The moves that bring an Album (and the files beside it) to destination
+AlbumPlan = namedtuple('AlbumPlan', 'album destination moves')
+
+# A destination claimed by more than one source, or by a file on disc
+Collision = namedtuple('Collision', 'destination sources existing')
+
+
+def _track_name(track, pattern):
+    """The file name of a Track under pattern"""
+    return compile_pattern(pattern).format(track, extension(track.path))
 
 
 def rename_tracks(target, pattern=TRACK_PATTERN):
@@ -33,10 +56,7 @@ def rename_tracks(target, pattern=TRACK_PATTERN):
     Pattern Example: '{artist} - {tracknumber} - {title}'
     """
     def rename_track(track, pattern):
-        supported_fields = track.supported_fields()
-        fields = {field: getattr(track, field) for field in supported_fields}
-        name = pattern.format(**fields) + extension(track.path)
-
+        name = _track_name(track, pattern)
         destination = os.path.join(parent(track.path), name)
         shutil.move(track.path, destination)
         track.path = destination
@@ -55,6 +75,8 @@ def move_album(album, destination):
     If the destination exists and is a folder, album will be placed inside
     of the folder. If the album is moving into a subpath of the existing path,
     the tracks will be moved (ie collection/artist -> collection/artist/album).
+    An album moved to another filesystem is copied and verified before the
+    original is removed (see library.transfer).
     """
     if os.path.isdir(destination):
         album_folder = os.path.basename(album.path)
@@ -73,7 +95,7 @@ def move_album(album, destination):
         for track in [x.path for x in album]:
             shutil.move(track, destination_path)
     else:
-        shutil.move(album.path, destination)
+        transfer.move_directory(album.path, destination_path)
 
     controller.set_album_path(album, destination_path)
 
@@ -90,9 +112,7 @@ def rename_album(album, pattern=None):
     if pattern is None:
         pattern = ALBUM_PATTERN
 
-    supported_fields = album.supported_fields()
-    fields = {field: getattr(album, field) for field in supported_fields}
-    name = pattern.format(**fields)
+    name = compile_pattern(pattern).format(album)
 
     album_parent = parent(album.path)
 
@@ -111,8 +131,23 @@ def reorganize_and_rename_collection(collection_root=COLLECTION_ROOT,
                                      album_pattern=ALBUM_PATTERN,
                                      track_pattern=TRACK_PATTERN,
                                      artist_pattern=ARTIST_PATTERN,
-                                     include_only=None):
-
+                                     include_only=None, dry_run=False,
+                                     workers=None, journal=None):
+    """Moves each album in a collection to where its tags place it
+
+    The destination of every file is planned from the tags of the whole
+    collection (see plan_reorganization) before any file is moved, and
+    the plan is then applied with renames (see apply_plan), so no audio
+    is copied when the collection is on a single filesystem.
+
+    If any destination collides (see find_collisions), FileExistsError
+    is raised before anything is moved. With dry_run, nothing is moved
+    and the plan is returned along with its collisions (see
+    describe_plan).
+
+    The plan may be applied by a number of workers, and recorded in a
+    journal to be resumed if interrupted, see apply_plan.
+    """
     if include_only:
         if isinstance(include_only, Album):
             collection = (include_only,)
@@ -121,43 +156,542 @@ def reorganize_and_rename_collection(collection_root=COLLECTION_ROOT,
     else:
         collection = controller.build_albums(collection_root, recursive=True)
 
-    for album in collection:
-        orig_path = album.path
-
-        tempdir = tempfile.mkdtemp()
-        dest_dir = os.path.join(tempdir, os.path.basename(album.path))
-        shutil.copytree(album.path, dest_dir)
-        controller.set_album_path(album, dest_dir)
-        dest_path = tempdir
-
-        for index, catagory in enumerate(organization_pattern.split('/')):
-            print(catagory)
-            if catagory == 'ARTIST':
-                dest_path = _name_to_pattern(
-                    album, dest_path, artist_pattern)
-            elif catagory == 'ALBUM':
-                dest_path = _name_to_pattern(
-                    album, dest_path, album_pattern)
-            elif catagory == 'TRACK':
-                rename_tracks(album, track_pattern)
+    plan = plan_reorganization(collection, collection_root,
+                               organization_pattern, album_pattern,
+                               track_pattern, artist_pattern)
+    collisions = find_collisions(plan)
+
+    if dry_run:
+        return plan, collisions
+    elif collisions:
+        raise FileExistsError("{} destinations collide, first: {}".format(
+            len(collisions), collisions[0].destination))
+
+    apply_plan(plan, collection_root, workers, journal)
+
+
+def plan_album(album, collection_root=COLLECTION_ROOT,
+               organization_pattern=ORGANIZATION_PATTERN,
+               album_pattern=ALBUM_PATTERN, track_pattern=TRACK_PATTERN,
+               artist_pattern=ARTIST_PATTERN):
+    """Returns the AlbumPlan placing an Album under collection_root
+
+    The tokens of organization_pattern (eg. 'ARTIST/ALBUM/TRACK') name
+    the directories of the destination after artist_pattern and
+    album_pattern, and rename tracks after track_pattern. Tracks come
+    first in the moves, in the order of the Album, followed by any other
+    files in the album's directory (eg. cover art), unless that directory
+    is collection_root itself, whose other files are left in place.
+    """
+    destination = collection_root
+    rename = False
+
+    for catagory in organization_pattern.split('/'):
+        if catagory == 'ARTIST':
+            name = compile_pattern(artist_pattern).format(album)
+            destination = os.path.join(destination, name)
+        elif catagory == 'ALBUM':
+            name = compile_pattern(album_pattern).format(album)
+            destination = os.path.join(destination, name)
+        elif catagory == 'TRACK':
+            rename = True
+        else:
+            raise Exception(
+                "{} is not a valid organization pattern token".format(
+                    catagory))
+
+    moves = []
+    for track in album:
+        if rename:
+            name = _track_name(track, track_pattern)
+        else:
+            name = filename(track.path)
+        moves.append(Move(track.path, os.path.join(destination, name)))
+
+    if os.path.abspath(album.path) == os.path.abspath(collection_root):
+        return AlbumPlan(album, destination, moves)
+
+    track_paths = set(x.path for x in album)
+    for name in os.listdir(album.path):
+        source = os.path.join(album.path, name)
+        if source not in track_paths and os.path.isfile(source):
+            moves.append(Move(source, os.path.join(destination, name)))
+
+    return AlbumPlan(album, destination, moves)
+
+
+def plan_reorganization(collection, collection_root=COLLECTION_ROOT,
+                        organization_pattern=ORGANIZATION_PATTERN,
+                        album_pattern=ALBUM_PATTERN,
+                        track_pattern=TRACK_PATTERN,
+                        artist_pattern=ARTIST_PATTERN):
+    """Returns a list of AlbumPlans for every Album in collection
+
+    Nothing on disc is changed. See plan_album.
+    """
+    return [plan_album(album, collection_root, organization_pattern,
+                       album_pattern, track_pattern, artist_pattern)
+            for album in collection]
+
+
+def _fold(path):
+    """Case folded path, as compared by case insensitive filesystems"""
+    if not isinstance(path, unicode):
+        path = path.decode('utf-8', 'replace')
+    return path.lower()
+
+
+def _folded_names(directory, listings):
+    """Case folded names in directory, listed once per directory"""
+    names = listings.get(directory)
+
+    if names is None:
+        try:
+            names = set(_fold(x) for x in os.listdir(directory))
+        except OSError:
+            names = set()
+        listings[directory] = names
+
+    return names
+
+
+def find_collisions(plan):
+    """Returns a list of the Collisions in a plan, sorted by destination
+
+    A destination collides when more than one Move claims it, or when a
+    file already there is not the source of a Move to it, in either case
+    ignoring case. A file that a plan moves elsewhere still collides, as
+    the plan would reach it before it had moved.
+
+    Claims are gathered in a single pass over the plan, and each
+    existing destination directory is listed once.
+    """
+    claims = {}
+    for album_plan in plan:
+        for move in album_plan.moves:
+            claim = claims.setdefault(_fold(move.destination),
+                                      (move.destination, []))
+            claim[1].append(move.source)
+
+    listings = {}
+    collisions = []
+    for folded, (destination, sources) in claims.items():
+        on_disc = _folded_names(os.path.dirname(destination), listings)
+        existing = (_fold(filename(destination)) in on_disc and
+                    folded not in set(_fold(x) for x in sources))
+
+        if len(sources) > 1 or existing:
+            collisions.append(Collision(destination, sources, existing))
+
+    return sorted(collisions)
+
+
+def describe_plan(plan, collisions=()):
+    """Yields a line for each Move of a plan, then for each Collision"""
+    for album_plan in plan:
+        for move in album_plan.moves:
+            if move.source != move.destination:
+                yield u'{} -> {}'.format(move.source, move.destination)
+
+    for collision in collisions:
+        claimants = list(collision.sources)
+        if collision.existing:
+            claimants.append(u'(existing file)')
+        yield u'Collision at {}: {}'.format(collision.destination,
+                                            u', '.join(claimants))
+
+
+def _move_file(source, destination):
+    """Renames source to destination, copying only across filesystems
+
+    See library.transfer.move_file.
+    """
+    if source == destination:
+        return
+
+    if os.path.exists(destination):
+        raise FileExistsError("File exists: {}".format(destination))
+
+    transfer.move_file(source, destination)
+
+
+def _copied(source, destination):
+    """Whether destination is a separate file with the contents of source"""
+    if os.path.samefile(source, destination):
+        return False
+
+    return filecmp.cmp(source, destination, shallow=False)
+
+
+def _remove_empty_directories(directory, stop):
+    """Removes directory and its parents, below stop, while they are empty"""
+    stop = os.path.abspath(stop)
+    directory = os.path.abspath(directory)
+
+    while directory != stop and directory.startswith(stop + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+
+def _make_directory(path):
+    """Creates a directory, unless it has already been created"""
+    try:
+        os.mkdir(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def _missing_directories(directories):
+    """The given directories, and their parents, that are not on disc"""
+    missing = set()
+    existing = set()
+
+    for directory in directories:
+        while directory not in existing and directory not in missing:
+            if os.path.isdir(directory):
+                existing.add(directory)
+                break
+            missing.add(directory)
+            directory = os.path.dirname(directory)
+
+    return missing
+
+
+def _by_depth(paths):
+    """Groups paths into lists of equal depth, shallowest first"""
+    depths = {}
+    for path in paths:
+        depths.setdefault(os.path.abspath(path).count(os.sep), []).append(path)
+
+    return [depths[x] for x in sorted(depths)]
+
+
+class _Journal(object):
+    """Append only record, one JSON object per line, of a plan's progress
+
+    The plan is written, and synced to disc, before anything is moved:
+
+        {"root": collection_root, "sources": [album directories]}
+        {"move": number, "source": path, "destination": path}
+
+    Each move is then marked {"done": number} as it completes, and
+    {"complete": true} is written once the plan has been applied. A new
+    plan (mode 'w') replaces whatever the journal held before.
+    """
+
+    def __init__(self, path, mode='a'):
+        self.path = path
+        self._file = open(path, mode)
+        self._lock = threading.Lock()
+
+    def write(self, entry, sync=False):
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def write_plan(self, collection_root, sources, moves):
+        with self._lock:
+            self._file.write(json.dumps({'root': collection_root,
+                                         'sources': sources}) + '\n')
+            for number, move in enumerate(moves):
+                self._file.write(json.dumps({
+                    'move': number, 'source': move.source,
+                    'destination': move.destination}) + '\n')
+
+        self.write({'plan': len(moves)}, sync=True)
+
+    def close(self):
+        self._file.close()
+
+
+def _read_journal(path):
+    """Returns the root, sources, moves, done moves and completion of a plan
+
+    Lines that cannot be read (eg. one left half written by a crash) are
+    skipped. A journal with no complete plan records no moves. Should a
+    journal hold more than one plan, only the last is read.
+    """
+    collection_root = None
+    sources = []
+    moves = []
+    done = set()
+    planned = complete = False
+
+    with open(path) as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+
+            if 'root' in entry:
+                collection_root, sources = entry['root'], entry['sources']
+                moves = []
+                done = set()
+                planned = complete = False
+            elif 'move' in entry:
+                moves.append(Move(entry['source'], entry['destination']))
+            elif 'plan' in entry:
+                planned = len(moves) == entry['plan']
+            elif 'done' in entry:
+                done.add(entry['done'])
+            elif 'complete' in entry:
+                complete = True
+
+    if not planned:
+        moves = []
+
+    return collection_root, sources, moves, done, complete
+
+
+def _apply_moves(moves, sources, collection_root, workers, journal):
+    """Applies numbered Moves as described in apply_plan
+
+    Takes (number, Move) pairs and the source directories to clean up
+    afterwards, marking each move done in the journal (if any).
+    """
+    if workers is None:
+        pool = None
+        run = map
+    else:
+        pool = ThreadPool(workers or None)
+        run = pool.map
+
+    def move_file(numbered):
+        number, move = numbered
+        _move_file(*move)
+        if journal is not None:
+            journal.write({'done': number})
+
+    try:
+        destinations = set(os.path.dirname(x.destination) for _, x in moves)
+        for directories in _by_depth(_missing_directories(destinations)):
+            run(_make_directory, directories)
+
+        run(move_file, moves)
+
+        # Nested albums are emptied before the albums that contain them
+        for directories in reversed(_by_depth(set(sources))):
+            run(lambda x: _remove_empty_directories(x, collection_root),
+                directories)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if journal is not None:
+        journal.write({'complete': True}, sync=True)
+
+
+def apply_plan(plan, collection_root=COLLECTION_ROOT, workers=None,
+               journal=None):
+    """Applies a list of AlbumPlans, updating the paths of their Albums
+
+    Missing directories are created first, parents before children. Files
+    are then moved with a rename each, and directories left empty under
+    collection_root are removed last, children before parents.
+
+    Given a number of workers, each step is carried out by a pool of that
+    many threads (0 sizes the pool to the number of cores), which hides
+    the latency of each operation on network filesystems. Directories of
+    the same depth are created (or removed) together, so no directory is
+    created before its parent or removed before its children. The
+    default, None, applies the plan serially.
+
+    Given the path of a journal, the plan is recorded there before
+    anything is moved and each move is marked as it completes, so that
+    an interrupted run can be finished by resume_reorganization.
+    """
+    moves = [move for album_plan in plan for move in album_plan.moves]
+    sources = [album_plan.album.path for album_plan in plan]
+
+    log = None
+    if journal is not None:
+        log = _Journal(journal, 'w')
+        log.write_plan(collection_root, sources, moves)
+
+    try:
+        _apply_moves(list(enumerate(moves)), sources, collection_root,
+                     workers, log)
+    finally:
+        if log is not None:
+            log.close()
+
+    for album_plan in plan:
+        album = album_plan.album
+        album.path = album_plan.destination
+        for track, move in zip(album, album_plan.moves):
+            track.path = move.destination
+
+
+def resume_reorganization(journal, workers=None):
+    """Finishes applying the plan recorded in a journal by apply_plan
+
+    Only the journal is read: the collection is not walked again and no
+    tags are read. Moves not marked done are applied, except those whose
+    source is gone and destination present (moved just before the
+    interruption). A move whose destination is already a copy of its
+    source, as left by a copy across filesystems interrupted before the
+    source was removed, is finished by removing the source. Returns the
+    number of moves applied, which is 0 for a completed plan or one
+    interrupted before anything was moved.
+    """
+    collection_root, sources, moves, done, complete = _read_journal(journal)
+    if complete or not moves:
+        return 0
+
+    log = _Journal(journal)
+    try:
+        pending = []
+        copied = 0
+        for number, move in enumerate(moves):
+            if number in done:
+                continue
+            elif not os.path.lexists(move.destination):
+                pending.append((number, move))
+            elif not os.path.lexists(move.source):
+                continue
+            elif _copied(*move):
+                os.remove(move.source)
+                log.write({'done': number})
+                copied += 1
             else:
-                raise Exception(
-                    "{} is not a valid organization pattern token".format(
-                        catagory))
+                pending.append((number, move))
+
+        _apply_moves(pending, sources, collection_root, workers, log)
+    finally:
+        log.close()
+
+    return len(pending) + copied
 
-            if index == 0:
-                root_path = dest_path
 
-        if not os.path.isdir(collection_root):
-            os.mkdir(collection_root)
-        shutil.move(root_path, collection_root)
+# Records, within a link farm, the source of each link it holds
+LINK_MANIFEST = '.r3tagger-links.json'
 
-        shutil.rmtree(tempdir)
-        shutil.rmtree(orig_path)
 
+def _text(path):
+    """path as unicode, so paths compare alike whichever type they had"""
+    if isinstance(path, unicode):
+        return path
+    return path.decode('utf-8', 'replace')
 
-def _name_to_pattern(album, dest_dir, pattern):
-    name = pattern.format(**controller.get_fields(album))
-    dest = os.path.join(dest_dir, name)
-    move_album(album, dest)
-    return dest
+
+def _read_manifest(view_root):
+    """The links recorded in a link farm, as {link: source}"""
+    try:
+        with open(os.path.join(view_root, LINK_MANIFEST)) as manifest:
+            return json.load(manifest)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_manifest(view_root, links):
+    """Replaces the manifest of a link farm in a single rename"""
+    manifest_path = os.path.join(view_root, LINK_MANIFEST)
+    with open(manifest_path + '.new', 'w') as manifest:
+        json.dump(links, manifest)
+    os.rename(manifest_path + '.new', manifest_path)
+
+
+def _remove_link(path):
+    """Removes a link, unless it is already gone"""
+    try:
+        os.remove(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def link_collection(collection, view_root,
+                    organization_pattern=ORGANIZATION_PATTERN,
+                    album_pattern=ALBUM_PATTERN, track_pattern=TRACK_PATTERN,
+                    artist_pattern=ARTIST_PATTERN, symbolic=False,
+                    workers=None):
+    """Mirrors a collection, organized by its tags, as links under view_root
+
+    Rather than moving any file, each is linked (hard links by default,
+    or symbolic links) at the destination that plan_reorganization gives
+    it under view_root. The source collection is left untouched.
+
+    The links are recorded in a manifest within view_root. Later calls
+    only remove the links whose destination or source has changed (eg.
+    after a retag) and create the new ones, and directories left empty
+    in view_root are removed. Links may be made by a number of workers,
+    as in apply_plan.
+
+    Raises FileExistsError, before changing anything, if two files would
+    be linked at the same destination. Returns the number of links
+    created and removed.
+    """
+    plan = plan_reorganization(collection, view_root, organization_pattern,
+                               album_pattern, track_pattern, artist_pattern)
+
+    links = {}
+    claimed = set()
+    for album_plan in plan:
+        for move in album_plan.moves:
+            folded = _fold(move.destination)
+            if folded in claimed:
+                raise FileExistsError("Destinations collide: {}".format(
+                    move.destination))
+            claimed.add(folded)
+            links[_text(move.destination)] = _text(
+                os.path.abspath(move.source))
+
+    recorded = _read_manifest(view_root)
+    removed = [x for x, source in recorded.items() if links.get(x) != source]
+    created = [(source, x) for x, source in links.items()
+               if recorded.get(x) != source]
+
+    make_link = os.symlink if symbolic else os.link
+    made = []
+
+    def link_file(link):
+        make_link(*link)
+        made.append(link)
+
+    if not os.path.isdir(view_root):
+        os.makedirs(view_root)
+
+    if workers is None:
+        pool = None
+        run = map
+    else:
+        pool = ThreadPool(workers or None)
+        run = pool.map
+
+    completed = False
+    try:
+        run(_remove_link, removed)
+
+        destinations = set(os.path.dirname(x) for _, x in created)
+        for directories in _by_depth(_missing_directories(destinations)):
+            run(_make_directory, directories)
+
+        run(link_file, created)
+
+        emptied = set(os.path.dirname(x) for x in removed)
+        for directories in reversed(_by_depth(emptied)):
+            run(lambda x: _remove_empty_directories(x, view_root),
+                directories)
+
+        completed = True
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        # After a failure, record only the links known to be there
+        if not completed:
+            links = dict((x, y) for x, y in recorded.items()
+                         if os.path.lexists(x))
+            links.update((x, y) for y, x in made)
+        _write_manifest(view_root, links)
+
+    return len(created), len(removed)
@@ -0,0 +1,249 @@
+"""r3tagger.library.scan
+
+Finds the audio files in a collection while reading as little of it as
+possible. Directory entries are classified from their dirent type where
+os.scandir (or the scandir backport) is available, and files are judged
+by their extension, so that cover art, cue sheets, logs and the like are
+never opened.
+
+Provides Functions:
+    is_audio(path:str, extensions=AUDIO_EXTENSIONS:set)
+    Determines if a file may be audio from its extension or first bytes
+
+    list_directory(path:str, extensions=AUDIO_EXTENSIONS:set)
+    Returns the subdirectories and audio file names in a directory
+
+    walk(path:str, extensions=AUDIO_EXTENSIONS:set)
+    Yields each directory below path along with its audio file names
+
+    read_tags(path:str)
+    Parses the tags of a file with a TagReader, returning the mutagen
+    file and the number of bytes read
+
+Provides Classes:
+    TagReader(path:str, head_size=HEAD_SIZE:int, tail_size=TAIL_SIZE:int)
+    Read-only file object that counts and bounds the bytes read from disc
+"""
+
+import os
+
+from mutagen import File
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # https://github.com/benhoyt/scandir
+    except ImportError:
+        scandir = None
+
+from r3tagger.library import extension
+
+
+# Extensions of the formats that mutagen can read
+AUDIO_EXTENSIONS = frozenset([
+    '.mp3', '.mp2', '.ogg', '.oga', '.opus', '.spx', '.flac', '.m4a',
+    '.m4b', '.mp4', '.aac', '.wma', '.asf', '.ape', '.wv', '.mpc', '.tta',
+    '.ofr', '.ofs', '.aif', '.aiff', '.dsf', '.wav'])
+
+# Extensions of files commonly kept alongside audio, which are skipped
+# without being opened
+IGNORED_EXTENSIONS = frozenset([
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.cue',
+    '.log', '.nfo', '.txt', '.m3u', '.m3u8', '.pls', '.pdf', '.sfv',
+    '.md5', '.ffp', '.accurip', '.db', '.ini', '.url', '.htm', '.html'])
+
+# Regions read whole by a TagReader: the ID3v2 tag, FLAC metadata blocks
+# and first Ogg pages sit in the head, and ID3v1 and APE tags and the
+# last Ogg page (which gives its length) sit in the tail
+HEAD_SIZE = 64 * 1024
+TAIL_SIZE = 64 * 1024
+
+# Leading bytes of the audio formats that mutagen can read
+_MAGIC = ('ID3', 'OggS', 'fLaC', 'RIFF', 'FORM', 'MAC ', 'wvpk', 'MPCK',
+          'MP+', 'TTA1', 'OFR ', 'DSD ',
+          '\x30\x26\xb2\x75\x8e\x66\xcf\x11')  # ASF header GUID
+
+
+def _sniff(path):
+    """Determines if a file starts like an audio file"""
+    try:
+        with open(path, 'rb') as audio:
+            head = audio.read(12)
+    except IOError:
+        return False
+
+    if head.startswith(_MAGIC):
+        return True
+
+    # MP4 'ftyp' box, or an MPEG audio frame without any ID3 tag
+    return (head[4:8] == 'ftyp' or
+            (len(head) > 1 and head[0] == '\xff' and
+             ord(head[1]) & 0xe0 == 0xe0))
+
+
+def is_audio(path, extensions=AUDIO_EXTENSIONS):
+    """Determines if a file may be audio
+
+    Files are judged by their extension: those in extensions are audio
+    and those in IGNORED_EXTENSIONS are not. Only files with any other
+    extension are opened, to check their first few bytes.
+    """
+    ext = extension(path).lower()
+
+    if ext in extensions:
+        return True
+    elif ext in IGNORED_EXTENSIONS:
+        return False
+
+    return _sniff(path)
+
+
+def list_directory(path, extensions=AUDIO_EXTENSIONS):
+    """Returns the subdirectory paths and audio file names in a directory
+
+    Without scandir, each entry is stat'ed to tell directories apart.
+    Symbolic links to directories are left out, as os.walk does not
+    follow them either.
+    """
+    subdirectories = []
+    names = []
+
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file() and is_audio(entry.path, extensions):
+                names.append(entry.name)
+
+    else:
+        for name in os.listdir(path):
+            entry = os.path.join(path, name)
+            if os.path.isdir(entry):
+                if not os.path.islink(entry):
+                    subdirectories.append(entry)
+            elif is_audio(entry, extensions):
+                names.append(name)
+
+    return subdirectories, names
+
+
+def walk(path, extensions=AUDIO_EXTENSIONS):
+    """Yields (directory, audio file names) for path and its subdirectories
+
+    Directories are yielded top down, in the order that os.walk would.
+    """
+    pending = [path]
+
+    while pending:
+        directory = pending.pop()
+
+        try:
+            subdirectories, names = list_directory(directory, extensions)
+        except OSError:
+            continue
+
+        yield directory, names
+        pending.extend(reversed(subdirectories))
+
+
+class TagReader(object):
+    """Read-only file object over a file that only reads what is asked of it
+
+    A read within the first head_size bytes of the file is served from a
+    single read of that region, as is a read within the last tail_size
+    bytes, so the many small reads a tag parser makes cost at most two
+    reads from disc. Anything else (eg. an ID3v2 tag larger than the
+    head) is read directly, without any buffering or read ahead.
+
+    bytes_read counts the bytes actually read from the file.
+    """
+
+    def __init__(self, path, head_size=HEAD_SIZE, tail_size=TAIL_SIZE):
+        self.name = path
+        self.bytes_read = 0
+
+        self._file = open(path, 'rb', 0)
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._position = 0
+
+        self._head_end = min(head_size, self._size)
+        self._tail_start = max(self._size - tail_size, self._head_end)
+        self._head = None
+        self._tail = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_at(self, start, end):
+        """Reads the bytes from start up to end directly from the file"""
+        self._file.seek(start)
+        chunks = []
+        remaining = end - start
+
+        while remaining > 0:
+            chunk = self._file.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        data = ''.join(chunks)
+        self.bytes_read += len(data)
+        return data
+
+    def read(self, size=-1):
+        start = self._position
+        end = self._size if size < 0 else min(start + size, self._size)
+        if end <= start:
+            return ''
+
+        if end <= self._head_end:
+            if self._head is None:
+                self._head = self._read_at(0, self._head_end)
+            data = self._head[start:end]
+        elif start >= self._tail_start:
+            if self._tail is None:
+                self._tail = self._read_at(self._tail_start, self._size)
+            data = self._tail[start - self._tail_start:end - self._tail_start]
+        else:
+            data = self._read_at(start, end)
+
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._size
+
+        if offset < 0:
+            raise IOError('Invalid seek to {} in {}'.format(offset, self.name))
+
+        self._position = offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._file.close()
+
+
+def read_tags(path):
+    """Parses the tags, length and bitrate of the file at path
+
+    Returns the mutagen file (opened with easy=True, or None if the file
+    is not supported) and the number of bytes read from disc. The mutagen
+    file keeps the path, so changes to it can still be saved.
+    """
+    with TagReader(path) as reader:
+        song_file = File(reader, easy=True)
+
+    if song_file is not None:
+        song_file.filename = path
+
+    return song_file, reader.bytes_read
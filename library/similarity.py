@@ -0,0 +1,279 @@
+"""r3tagger.library.similarity
+
+Finds recordings that sound alike (eg. the same rip at two bitrates) by
+comparing their Acoustid fingerprints, without comparing every pair.
+
+A fingerprint decodes to a sequence of 32 bit items, one per eighth of a
+second or so, and two encodings of one recording differ in only a few
+bits of each item. Fingerprints are held in a FingerprintIndex as NumPy
+arrays and compared by XOR and bit count. Only those sharing the leading
+bits of some of their first items (see KEY_BITS and QUERY_SIZE) are ever
+compared, which leaves few pairs to score even across a large library.
+
+Requires NumPy (http://numpy.org/).
+
+Provides Functions:
+    decode_fingerprint(fingerprint:str)
+    Returns the items of a compressed, base64 encoded fingerprint
+
+Provides Classes:
+    FingerprintIndex(size=SIZE:int, threshold=THRESHOLD:float)
+    Fingerprints keyed on Tracks (or any value), searched for near matches
+"""
+
+import base64
+
+import acoustid
+
+try:
+    import numpy
+except ImportError:
+    raise ImportError('library.similarity requires NumPy '
+                      '(http://numpy.org/)')
+
+
+# Items of each fingerprint kept and compared (about a minute of audio)
+SIZE = 480
+
+# Leading items of each fingerprint used to find candidates
+QUERY_SIZE = 120
+
+# Leading bits of those items that candidates must share
+KEY_BITS = 20
+
+# Shared keys a fingerprint needs to be compared with another
+MIN_SHARED = 2
+
+# Keys held by more fingerprints than this (eg. silence) are ignored
+MAX_POSTINGS = 1000
+
+# Offsets, in items, at which two fingerprints are compared
+MAX_OFFSET = 2
+
+# Share of matching bits above which two fingerprints are alike
+THRESHOLD = 0.85
+
+# Bits set in each byte
+_POPCOUNT = numpy.array([bin(x).count('1') for x in range(256)],
+                        dtype=numpy.uint8)
+
+
+def _unpack(data, width, count):
+    """The first count width bit values packed least significant first"""
+    bits = numpy.unpackbits(data)
+    bits = bits.reshape(-1, 8)[:, ::-1].ravel()
+    count = min(count, len(bits) // width)
+    weights = 1 << numpy.arange(width)
+
+    return bits[:count * width].reshape(count, width).dot(weights)
+
+
+def decode_fingerprint(fingerprint):
+    """Returns the items of a fingerprint as a numpy.uint32 array
+
+    Takes the compressed, URL safe base64 form given by fpcalc and
+    acoustid.fingerprint_file. Raises ValueError if it is malformed.
+    """
+    if isinstance(fingerprint, unicode):
+        fingerprint = fingerprint.encode('ascii')
+
+    padding = '=' * (-len(fingerprint) % 4)
+    try:
+        data = base64.urlsafe_b64decode(fingerprint + padding)
+    except TypeError:
+        raise ValueError('Fingerprint is not base64 encoded')
+
+    if len(data) < 4:
+        raise ValueError('Fingerprint is too short')
+
+    count = (ord(data[1]) << 16) | (ord(data[2]) << 8) | ord(data[3])
+    data = numpy.frombuffer(data, dtype=numpy.uint8, offset=4)
+
+    # Each item is the runs between its set bits, as 3 bit values ending
+    # with a 0. Runs of 7 or more continue as 5 bit values further on.
+    runs = _unpack(data, 3, len(data) * 8 // 3)
+    ends = numpy.flatnonzero(runs == 0)
+    if len(ends) < count:
+        raise ValueError('Fingerprint is truncated')
+
+    runs = runs[:ends[count - 1] + 1] if count else runs[:0]
+    long_runs = numpy.flatnonzero(runs == 7)
+    if len(long_runs):
+        offset = (len(runs) * 3 + 7) // 8
+        extra = _unpack(data[offset:], 5, len(long_runs))
+        if len(extra) < len(long_runs):
+            raise ValueError('Fingerprint is truncated')
+        runs[long_runs] += extra
+
+    # Bit positions restart at each 0, which moves on to the next item
+    ends = runs == 0
+    item = numpy.cumsum(ends) - ends
+    totals = numpy.cumsum(runs)
+    starts = numpy.concatenate(([0], totals[ends][:-1]))
+    position = totals - starts[item]
+
+    # The bits of an item are distinct, so summing them sets each one
+    set_bits = ~ends
+    bits = numpy.left_shift(1, position[set_bits] - 1)
+    values = numpy.bincount(item[set_bits], bits, minlength=count)
+
+    # Items are stored as the XOR of each with the one before
+    return numpy.bitwise_xor.accumulate(values.astype(numpy.uint32))
+
+
+def _items(fingerprint, size):
+    if not isinstance(fingerprint, numpy.ndarray):
+        fingerprint = decode_fingerprint(fingerprint)
+
+    return numpy.ascontiguousarray(fingerprint[:size], dtype=numpy.uint32)
+
+
+def _similarity(items, other, max_offset):
+    """Best share of matching bits between two fingerprints, over offsets"""
+    best = 0.0
+    for offset in range(-max_offset, max_offset + 1):
+        if offset < 0:
+            first, second = items[-offset:], other
+        else:
+            first, second = items, other[offset:]
+
+        length = min(len(first), len(second))
+        if not length:
+            continue
+
+        differing = numpy.bitwise_xor(first[:length], second[:length])
+        errors = _POPCOUNT[differing.view(numpy.uint8)].sum(dtype='int64')
+        best = max(best, 1.0 - float(errors) / (32 * length))
+
+    return best
+
+
+class FingerprintIndex(object):
+    """Fingerprints held for finding near matches among them
+
+    Each fingerprint is added with a key, such as the Track it belongs
+    to, and only its first size items are kept. Keys are handed back by
+    search and clusters. Fingerprints may be added after searching, in
+    which case the index is rebuilt at the next search.
+    """
+
+    def __init__(self, size=SIZE, threshold=THRESHOLD):
+        self.size = size
+        self.threshold = threshold
+        self.keys = []
+        self._items = []
+        self._buckets = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, fingerprint):
+        """Adds a fingerprint, as given by acoustid or already decoded"""
+        self._items.append(_items(fingerprint, self.size))
+        self.keys.append(key)
+        self._buckets = None
+
+    def add_tracks(self, tracks):
+        """Adds the fingerprint of each Track, keyed on the Track
+
+        Tracks that cannot be fingerprinted are left out.
+        """
+        for track in tracks:
+            try:
+                fingerprint = track.fingerprint
+            except acoustid.FingerprintGenerationError:
+                continue
+            if fingerprint:
+                self.add(track, fingerprint)
+
+    def _build(self):
+        """Sorts the query keys of every fingerprint, with their rows"""
+        shift = 32 - KEY_BITS
+        keys = [numpy.unique(x[:QUERY_SIZE] >> shift) for x in self._items]
+        rows = [numpy.full(len(x), row, dtype=numpy.int64)
+                for row, x in enumerate(keys)]
+
+        keys = numpy.concatenate(keys) if keys else numpy.zeros(0, 'uint32')
+        rows = numpy.concatenate(rows) if rows else numpy.zeros(0, 'int64')
+        order = numpy.argsort(keys, kind='mergesort')
+
+        self._buckets = (keys[order], rows[order])
+
+    def _candidates(self, items):
+        """Rows sharing at least MIN_SHARED query keys with items"""
+        if self._buckets is None:
+            self._build()
+        keys, rows = self._buckets
+
+        query = numpy.unique(items[:QUERY_SIZE] >> (32 - KEY_BITS))
+        starts = numpy.searchsorted(keys, query, 'left')
+        ends = numpy.searchsorted(keys, query, 'right')
+
+        lengths = ends - starts
+        kept = (lengths > 0) & (lengths <= MAX_POSTINGS)
+        starts, lengths = starts[kept], lengths[kept]
+        if not len(starts):
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        # The positions of every row in each key's range, end to end
+        offsets = numpy.repeat(starts - numpy.cumsum(lengths) + lengths,
+                               lengths)
+        found = rows[offsets + numpy.arange(lengths.sum())]
+
+        candidates, shared = numpy.unique(found, return_counts=True)
+        return candidates[shared >= MIN_SHARED]
+
+    def _matches(self, items, threshold, after=-1):
+        """(similarity, row) of fingerprints alike to items, best first
+
+        Only rows past after are compared.
+        """
+        matches = []
+        candidates = self._candidates(items)
+        for row in candidates[candidates > after]:
+            score = _similarity(items, self._items[row], MAX_OFFSET)
+            if score >= threshold:
+                matches.append((score, row))
+
+        return sorted(matches, reverse=True)
+
+    def search(self, fingerprint, threshold=None):
+        """Returns (similarity, key) for fingerprints alike, best first
+
+        similarity is the share of bits the two fingerprints have in
+        common, over the items both have, at the best of a few offsets.
+        """
+        if threshold is None:
+            threshold = self.threshold
+
+        items = _items(fingerprint, self.size)
+        return [(score, self.keys[row])
+                for score, row in self._matches(items, threshold)]
+
+    def clusters(self, threshold=None):
+        """Returns lists of the keys of fingerprints alike to each other
+
+        Fingerprints are grouped when alike to any other in the group, so
+        each list holds every copy of one recording found. Fingerprints
+        alike to no other are left out.
+        """
+        if threshold is None:
+            threshold = self.threshold
+
+        parents = range(len(self._items))
+
+        def root(row):
+            while parents[row] != row:
+                parents[row] = parents[parents[row]]
+                row = parents[row]
+            return row
+
+        for row, items in enumerate(self._items):
+            for _, other in self._matches(items, threshold, row):
+                parents[root(other)] = root(row)
+
+        groups = {}
+        for row in range(len(self._items)):
+            groups.setdefault(root(row), []).append(self.keys[row])
+
+        return [x for x in groups.values() if len(x) > 1]
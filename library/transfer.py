@@ -0,0 +1,266 @@
+"""r3tagger.library.transfer
+
+Moves files and albums, including across filesystems. A rename is tried
+first; when the destination is on another filesystem the data is copied
+by the kernel where it can be (a reflink, copy_file_range or sendfile),
+verified, and only then is the source removed.
+
+Provides Functions:
+    copy_file(source:str, destination:str)
+    Copies a file's data and metadata, returning the method used
+
+    move_file(source:str, destination:str, checksum=False:bool)
+    Moves a file, copying and verifying it across filesystems
+
+    move_directory(source:str, destination:str, checksum=False:bool)
+    Moves a directory, copying and verifying it across filesystems
+
+    move_albums(moves:iterable, workers=None:int, checksum=False:bool)
+    Moves several album directories at once, returning a TransferReport
+
+    transfer_statistics
+    Counter of the files, bytes and seconds spent copying across
+    filesystems, and of the copy methods used
+
+Provides Classes:
+    TransferReport(files:int, bytes:int, seconds:float)
+    Totals of a set of moves, with their throughput
+"""
+
+import os
+import time
+import errno
+import fcntl
+import shutil
+import ctypes
+import ctypes.util
+import hashlib
+import threading
+from collections import Counter, namedtuple
+from multiprocessing.pool import ThreadPool
+
+
+# ioctl that shares the extents of one file with another (btrfs, xfs)
+_FICLONE = 0x40049409
+
+# Largest request made of copy_file_range or sendfile at once
+_CHUNK_SIZE = 1 << 30
+
+# Errors meaning that a kernel copy is unsupported for a pair of files
+_UNSUPPORTED = set([errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                    errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF])
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    _libc = None
+
+_copy_file_range = getattr(_libc, 'copy_file_range', None)
+if _copy_file_range is not None:
+    _copy_file_range.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                                 ctypes.c_void_p, ctypes.c_size_t,
+                                 ctypes.c_uint)
+    _copy_file_range.restype = ctypes.c_ssize_t
+
+_sendfile = getattr(_libc, 'sendfile', None)
+if _sendfile is not None:
+    _sendfile.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                          ctypes.c_size_t)
+    _sendfile.restype = ctypes.c_ssize_t
+
+# Counts of 'files', 'bytes' and 'seconds' copied across filesystems,
+# and of each copy method used
+transfer_statistics = Counter()
+_statistics_lock = threading.Lock()
+
+
+class TransferReport(namedtuple('TransferReport', 'files bytes seconds')):
+    """Totals of a set of moves across filesystems"""
+
+    @property
+    def throughput(self):
+        """Bytes copied per second"""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+def _reflink(source, destination, size):
+    fcntl.ioctl(destination.fileno(), _FICLONE, source.fileno())
+    return size
+
+
+def _kernel_copy(function, arguments):
+    """Copies with copy_file_range or sendfile until they copy no more"""
+    def copy(source, destination, size):
+        copied = 0
+        while copied < size:
+            count = min(size - copied, _CHUNK_SIZE)
+            written = function(*arguments(source.fileno(),
+                                          destination.fileno(), count))
+            if written < 0:
+                error = ctypes.get_errno()
+                raise IOError(error, os.strerror(error))
+            elif written == 0:
+                break
+            copied += written
+
+        return copied
+
+    return copy
+
+
+def _userspace_copy(source, destination, size):
+    shutil.copyfileobj(source, destination, 1 << 20)
+    return size
+
+
+_METHODS = [('reflink', _reflink)]
+if _copy_file_range is not None:
+    _METHODS.append(('copy_file_range', _kernel_copy(
+        _copy_file_range, lambda src, dst, count: (src, None, dst, None,
+                                                   count, 0))))
+if _sendfile is not None:
+    _METHODS.append(('sendfile', _kernel_copy(
+        _sendfile, lambda src, dst, count: (dst, src, None, count))))
+_METHODS.append(('userspace', _userspace_copy))
+
+
+def copy_file(source, destination):
+    """Copies the data and metadata of source to destination
+
+    Each method is tried in turn (reflink, copy_file_range, sendfile and
+    then an ordinary copy) until one is supported for the two files.
+    Returns the name of the method used.
+    """
+    with open(source, 'rb') as source_file:
+        with open(destination, 'wb') as destination_file:
+            size = os.fstat(source_file.fileno()).st_size
+
+            for method, copy in _METHODS:
+                try:
+                    copy(source_file, destination_file, size)
+                except (IOError, OSError) as error:
+                    position = os.lseek(destination_file.fileno(), 0, 1)
+                    if error.errno not in _UNSUPPORTED or position:
+                        raise
+                    continue
+                break
+
+            destination_file.flush()
+            os.fsync(destination_file.fileno())
+
+    shutil.copystat(source, destination)
+    return method
+
+
+def _digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(1 << 20), ''):
+            digest.update(chunk)
+
+    return digest.digest()
+
+
+def _verify(source, copied, checksum):
+    """Raises IOError unless copied matches source"""
+    if os.path.getsize(source) != os.path.getsize(copied) or (
+            checksum and _digest(source) != _digest(copied)):
+        raise IOError(errno.EIO, 'Copy of {} does not match'.format(source))
+
+
+def _copy_across(source, destination, checksum):
+    """Copies source to destination by way of a partial file, verified"""
+    partial = destination + '.r3tagger-part'
+    started = time.time()
+
+    try:
+        method = copy_file(source, partial)
+        _verify(source, partial, checksum)
+        os.rename(partial, destination)
+    except BaseException:
+        if os.path.lexists(partial):
+            os.remove(partial)
+        raise
+
+    size = os.path.getsize(destination)
+    with _statistics_lock:
+        transfer_statistics['files'] += 1
+        transfer_statistics['bytes'] += size
+        transfer_statistics['seconds'] += time.time() - started
+        transfer_statistics[method] += 1
+
+    return size
+
+
+def move_file(source, destination, checksum=False):
+    """Moves a file, copying it only if destination is on another filesystem
+
+    A copy is written beside destination, verified against source (by
+    size, or also by SHA-1 with checksum) and renamed into place before
+    source is removed, so an interrupted move never loses the file.
+    """
+    try:
+        os.rename(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        _copy_across(source, destination, checksum)
+        os.remove(source)
+
+
+def move_directory(source, destination, checksum=False):
+    """Moves a directory tree, copying it across filesystems as move_file
+
+    Returns the number of bytes copied, which is 0 for a rename. When
+    copied, source is only removed once every file has been verified.
+    """
+    try:
+        os.rename(source, destination)
+        return 0
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+
+    copied = 0
+    for root, directories, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+
+        for name in files:
+            copied += _copy_across(os.path.join(root, name),
+                                   os.path.join(target, name), checksum)
+
+        shutil.copystat(root, target)
+
+    shutil.rmtree(source)
+    return copied
+
+
+def move_albums(moves, workers=None, checksum=False):
+    """Moves (source, destination) album directories, several at a time
+
+    Given a number of workers, that many albums are moved at once by a
+    pool of threads (0 sizes the pool to the number of cores); the
+    default, None, moves them one at a time. Returns a TransferReport of
+    the files and bytes copied across filesystems and the time taken.
+    """
+    moves = list(moves)
+    before = transfer_statistics['files']
+    started = time.time()
+
+    def move(pair):
+        return move_directory(pair[0], pair[1], checksum)
+
+    if workers is None:
+        copied = map(move, moves)
+    else:
+        pool = ThreadPool(workers or None)
+        try:
+            copied = pool.map(move, moves)
+        finally:
+            pool.close()
+            pool.join()
+
+    return TransferReport(transfer_statistics['files'] - before,
+                          sum(copied), time.time() - started)
@@ -0,0 +1,112 @@
+"""r3tagger.library.watcher
+
+Requires: pyinotify (https://github.com/seb-m/pyinotify)
+
+Keeps the albums of a collection current by watching its directories
+with inotify, rather than rescanning the whole collection.
+
+Provides Classes:
+    CollectionWatcher(index:TagIndex, callback:callable, delay=1:float,
+                      max_delay=10:float)
+    Reports batches of AlbumDeltas for changes in watched directories
+"""
+
+import time
+import threading
+
+import pyinotify
+
+from r3tagger import controller
+
+
+# Creating, editing, moving or deleting any entry of a watched directory
+EVENT_MASK = (pyinotify.IN_CREATE | pyinotify.IN_CLOSE_WRITE |
+              pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO |
+              pyinotify.IN_DELETE | pyinotify.IN_DELETE_SELF)
+
+
+class CollectionWatcher(object):
+    """Watches directories and reports the albums that change in them
+
+    Events are gathered by directory and only handled once no other
+    event has arrived for delay seconds, so copying in an album results
+    in one update rather than one per file. Events that keep arriving
+    (eg. an album being ripped) are still handled once max_delay seconds
+    have passed since the first of them. The gathered directories are
+    then passed through controller.refresh_albums with the TagIndex, and
+    the resulting list of AlbumDeltas is given to callback.
+
+    The callback is invoked from a timer thread. Batches are handled one
+    at a time, so the index is never used by two batches at once.
+    """
+
+    def __init__(self, index, callback, delay=1, max_delay=10):
+        self.index = index
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+
+        self._pending = set()
+        self._first = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self._watches = pyinotify.WatchManager()
+        self._notifier = pyinotify.ThreadedNotifier(self._watches,
+                                                    self._queue_event)
+        self._notifier.daemon = True
+
+    def watch(self, path):
+        """Watches path and, as they appear, all of its subdirectories"""
+        self._watches.add_watch(path, EVENT_MASK, rec=True, auto_add=True)
+
+    def start(self):
+        """Begins delivering events"""
+        self._notifier.start()
+
+    def stop(self):
+        """Stops watching, discarding any events not yet handled"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._pending.clear()
+            self._first = None
+
+        self._notifier.stop()
+
+    def _queue_event(self, event):
+        """Records the directory of an event and restarts the delay
+
+        The delay is cut short so as not to end later than max_delay
+        after the first pending event.
+        """
+        now = time.time()
+        with self._lock:
+            self._pending.add(event.path)
+            if self._first is None:
+                self._first = now
+
+            if self._timer is not None:
+                self._timer.cancel()
+
+            wait = min(self.delay, self._first + self.max_delay - now)
+            self._timer = threading.Timer(max(wait, 0), self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Reports the changes in every directory with pending events"""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            self._first = None
+            self._timer = None
+
+        if not pending:
+            return
+
+        with self._flush_lock:
+            deltas = list(controller.refresh_albums(pending, self.index))
+
+            if deltas:
+                self.callback(deltas)
@@ -1,2 +1,3 @@
 from track import Track
 from album import Album
+from store import TrackStore
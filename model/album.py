@@ -5,6 +5,8 @@ Provides models:
     Represents an album of Tracks
 """
 
+from r3tagger.library.match import similarity
+
 
 class Album(object):
     """Contains a list of track and metadata that describes an album.
@@ -12,7 +14,9 @@ class Album(object):
     May be instantiated either using a collection of Track objects,
     or a dictionary of attribute values. Typically, such a populated
     dictionary might be returned by an external library in attempts
-    to describe an album for comparison with another album.
+    to describe an album for comparison with another album. Given Tracks
+    and lazy, the fields of the Album are read from its Tracks when
+    first used.
 
     Provides Methods:
         match(other:Album)
@@ -25,21 +29,45 @@ class Album(object):
 
     _supported_fields = ('artist', 'album', 'date', 'genre')
 
-    def __init__(self, arg):
+    def __init__(self, arg, lazy=False):
         if isinstance(arg, dict):
             for attrib in self.supported_fields():
                 setattr(self, attrib, arg.get(attrib, ''))
             self.tracks = arg.get('tracks', [])
         else:
             self.path = ''
-            self.album = ''
-            self.artist = ''
-            self.date = ''
-            self.genre = ''
             self.tracks = arg
+            if not lazy:
+                self.album = ''
+                self.artist = ''
+                self.date = ''
+                self.genre = ''
+
+    def __getattr__(self, attr):
+        """Fields of a lazy Album are those shared by its Tracks
+
+        Each is found when first used (reading that field of every
+        Track), or is empty if the Tracks disagree. Lazy Tracks whose
+        files turn out not to be supported are dropped from the Album.
+        """
+        if attr in self.supported_fields():
+            values = set()
+            for track in list(self.tracks):
+                try:
+                    values.add(getattr(track, attr))
+                except NotImplementedError:
+                    self.tracks.remove(track)
+            value = values.pop() if len(values) == 1 else ''
+            setattr(self, attr, value)
+            return value
+
+        raise AttributeError(attr)
 
     def __call__(self):
-        """Passes call to each Track in the Album"""
+        """Passes call to each Track in the Album
+
+        Only the Tracks with changed fields are written (see Track).
+        """
         for track in self:
             track()
 
@@ -55,31 +83,11 @@ class Album(object):
         This implementation will only take tracks into account if both
         Album objects have tracks. If only one, or neither have tracks,
         only the supported fields (Album._supported_fields) are used.
-        """
-
-        albums = []
 
-        info = set()
-        other_info = set()
-
-        for field in self.supported_fields():
-            attrib = getattr(self, field)
-            other_attrib = getattr(other, field)
-            if attrib and other_attrib:
-                info.add(attrib.lower())
-                other_info.add(other_attrib.lower())
-
-            if self.tracks and other.tracks:
-                info.update([str(x) for x in self.tracks if x])
-                other_info.update([str(x) for x in other.tracks if x])
-
-        print(albums)
-
-        nc = len(info.intersection(other_info))
-        na = len(info)
-        nb = len(other_info)
-
-        return float(nc) / (na + nb - nc)
+        See library.match.similarity, and library.match.Matcher for
+        scoring many candidates against one Album.
+        """
+        return similarity(self, other)
 
     @classmethod
     def supported_fields(cls):
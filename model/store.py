@@ -0,0 +1,230 @@
+"""r3tagger.model.Store
+
+Provides models:
+    TrackStore
+    Compact, column oriented store of the tags of many Tracks
+"""
+
+import os
+import re
+import sys
+from array import array
+
+from r3tagger.model.album import Album
+from r3tagger.model.track import Track
+
+
+# Values that are stored as numbers and rebuilt with their zero padding
+_NUMBER = re.compile(r'^[0-9]{1,9}$')
+
+
+class _StringPool(object):
+    """Interned strings, for values repeated across many rows"""
+
+    def __init__(self):
+        self._strings = []
+        self._ids = {}
+
+    def add(self, value):
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._ids[value] = string_id
+
+        return string_id
+
+    def __getitem__(self, string_id):
+        return self._strings[string_id]
+
+    def __len__(self):
+        return len(self._strings)
+
+
+class _PackedStrings(object):
+    """Byte strings packed end to end, for values that are rarely repeated"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array('L', [0])
+
+    def append(self, value):
+        self._data.extend(value)
+        self._offsets.append(len(self._data))
+
+    def __getitem__(self, row):
+        return str(self._data[self._offsets[row]:self._offsets[row + 1]])
+
+    def nbytes(self):
+        return len(self._data) + len(self._offsets) * self._offsets.itemsize
+
+
+class _StoredValues(object):
+    """The cached values of one row, in the form Track(cached=) expects"""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._store.value(self._row, key)
+
+    def get(self, key, default=None):
+        try:
+            value = self._store.value(self._row, key)
+        except KeyError:
+            return default
+        return default if value is None else value
+
+
+class TrackStore(object):
+    """Stores the fields, length and bitrate of Tracks in columns
+
+    Each Track added becomes a row. Rather than keeping a Track (and its
+    mutagen file) per row, each field is kept in a column:
+
+        artist, album, genre and directory: ids of interned strings
+        title and file name: bytes packed into a single buffer
+        tracknumber and date: numbers, with their zero padding
+        length and bitrate: numbers
+
+    Values that are not plain numbers (eg. a tracknumber of '3/12') are
+    kept aside for the rows that have them.
+
+    Tracks and Albums can then be read back from the store as views,
+    which only parse their file once a field is changed (see Track).
+    The store itself is a snapshot, and is not updated by such changes.
+    """
+
+    _pooled_fields = ('artist', 'album', 'genre')
+    _number_fields = ('tracknumber', 'date')
+
+    def __init__(self):
+        self._pool = _StringPool()
+        self._directories = array('i')
+        self._names = _PackedStrings()
+        self._titles = _PackedStrings()
+
+        self._pooled = dict((x, array('i')) for x in self._pooled_fields)
+        self._numbers = dict((x, array('i')) for x in self._number_fields)
+        self._widths = dict((x, array('b')) for x in self._number_fields)
+        self._irregular = dict((x, {}) for x in self._number_fields)
+
+        self._length = array('d')
+        self._bitrate = array('i')
+
+    def __len__(self):
+        return len(self._directories)
+
+    def append(self, track):
+        """Adds a row for the Track, returning its row number"""
+        row = len(self)
+        directory, name = os.path.split(track.path)
+
+        self._directories.append(self._pool.add(directory))
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        self._names.append(name)
+        self._titles.append((track.title or u'').encode('utf-8'))
+
+        for field in self._pooled_fields:
+            self._pooled[field].append(self._pool.add(getattr(track, field)))
+
+        for field in self._number_fields:
+            value = getattr(track, field) or u''
+
+            if _NUMBER.match(value):
+                self._numbers[field].append(int(value))
+                self._widths[field].append(len(value))
+            else:
+                self._numbers[field].append(0)
+                self._widths[field].append(0)
+                if value:
+                    self._irregular[field][row] = value
+
+        self._length.append(track.length or 0.0)
+        self._bitrate.append(track.bitrate or 0)
+
+        return row
+
+    def extend(self, albums):
+        """Adds a row for each Track of each Album"""
+        for album in albums:
+            for track in album:
+                self.append(track)
+
+    def value(self, row, field):
+        """Returns a supported field, 'length' or 'bitrate' of a row"""
+        if field == 'title':
+            return self._titles[row].decode('utf-8')
+        elif field in self._pooled:
+            return self._pool[self._pooled[field][row]]
+        elif field in self._numbers:
+            width = self._widths[field][row]
+            if not width:
+                return self._irregular[field].get(row, u'')
+            return unicode(self._numbers[field][row]).zfill(width)
+        elif field == 'length':
+            return self._length[row]
+        elif field == 'bitrate':
+            return self._bitrate[row]
+
+        raise KeyError(field)
+
+    def path(self, row):
+        """Returns the path of the file of a row"""
+        directory = self._pool[self._directories[row]]
+        name = self._names[row]
+        if isinstance(directory, unicode):
+            name = name.decode('utf-8')
+
+        return os.path.join(directory, name)
+
+    def track(self, row):
+        """Returns a Track that reads its values from a row"""
+        return Track(self.path(row), cached=_StoredValues(self, row))
+
+    def albums(self):
+        """Yields an Album of Track views for each directory in the store
+
+        Albums are yielded in the order that their first row was added.
+        """
+        rows_by_directory = {}
+        order = []
+        for row, directory in enumerate(self._directories):
+            if directory not in rows_by_directory:
+                rows_by_directory[directory] = []
+                order.append(directory)
+            rows_by_directory[directory].append(row)
+
+        for directory in order:
+            rows = rows_by_directory[directory]
+            album = Album([self.track(x) for x in rows])
+            album.path = self._pool[directory]
+
+            for field in album.supported_fields():
+                values = set(getattr(x, field) for x in album)
+                if len(values) == 1:
+                    setattr(album, field, values.pop())
+
+            yield album
+
+    def nbytes(self):
+        """Approximate number of bytes held by the columns of the store
+
+        Interned strings are counted once, at their size as objects.
+        """
+        columns = ([self._directories, self._length, self._bitrate] +
+                   self._pooled.values() + self._numbers.values() +
+                   self._widths.values())
+        total = sum(len(x) * x.itemsize for x in columns)
+        total += self._names.nbytes() + self._titles.nbytes()
+        total += sum(sys.getsizeof(x) + sum(sys.getsizeof(y)
+                                            for y in x.values())
+                     for x in self._irregular.values())
+        total += sum(sys.getsizeof(self._pool[x])
+                     for x in range(len(self._pool)))
+
+        return total
@@ -6,7 +6,9 @@ Provides models:
 """
 
 import acoustid
-from mutagen import File
+from mutagen import File, MutagenError
+
+from r3tagger.library.audiohash import audio_hash
 
 
 class Track(object):
@@ -15,7 +17,11 @@ class Track(object):
     _supported_fields = ('artist', 'album', 'title',
                          'tracknumber', 'date', 'genre')
 
-    def __init__(self, path, fields=None):
+    # A library.fingerprint.FingerprintCache shared by every Track, if set
+    fingerprint_cache = None
+
+    def __init__(self, path, fields=None, song_file=None, cached=None,
+                 lazy=False, reader=None, stat=None):
         """Instantiate Track object
 
         Requires a filepath for a song file to represent and accepts an
@@ -25,36 +31,75 @@ class Track(object):
 
         If no additional fields are specified, the Track instance's fields
         will be populated by metadata from the audio file.
+
+        A mutagen file that has already been opened (with easy=True) may
+        be passed as song_file to avoid parsing the file a second time.
+
+        Previously read values (eg. from a TagIndex) may be passed as a
+        cached mapping of the supported fields, 'length' and 'bitrate',
+        and optionally 'audio_hash'. The file is then only parsed once a
+        field is changed or saved.
+
+        If lazy is True, nothing is read from the file until a field,
+        length or bitrate is first used, so a file that turns out not to
+        be supported (or fails to parse) raises NotImplementedError at
+        that point. The
+        os.stat result of the file may be given as stat (eg. from listing
+        its directory), and is kept as the Track's stat.
+
+        A reader may be given to parse the file in place of mutagen's
+        File (eg. library.scan.read_tags, which only reads the regions
+        of the file holding tags). It takes the path and returns the
+        mutagen file and the bytes read, which are kept in bytes_read.
         """
 
         self.path = path
-        mutagen_song = File(path, easy=True)
-        if mutagen_song is not None:
-            self._song_file = mutagen_song
-        else:
-            raise NotImplementedError("File not compatible: {}".format(path))
+        self.stat = stat
+        self._cached = cached
+        self._reader = reader
+        self._song_file = None
+
+        # Bytes read from disc when parsed by a reader
+        self.bytes_read = None
+
+        # Values of changed fields as they were loaded, see changed_fields
+        self._original = {}
+
+        if cached is None and not lazy:
+            self._load(song_file)
 
         # Fill in tags if given a dict
         if fields is not None:
             for field in self.supported_fields():
-                self._song_file[field] = fields.get(field, None)
+                setattr(self, field, fields.get(field, None))
 
         # Populated in fingerprint method
         self._fingerprint = None
 
+        # Populated in content_hash method
+        self._content_hash = None
+
     def __call__(self):
-        """Shortcut to _update_file: Saves updated metadata to file."""
-        self._update_file()
+        """Shortcut to _update_file: Saves updated metadata to file.
+
+        Returns True if the file was written.
+        """
+        return self._update_file()
 
     def __setattr__(self, attr, val):
         if attr in self.supported_fields():
-            self._song_file[attr] = val
+            song_file = self._loaded_song_file()
+            if attr not in self._original:
+                self._original[attr] = song_file.get(attr)
+            song_file[attr] = val
         else:
             self.__dict__[attr] = val
 
     def __getattr__(self, attr):
         if attr in self.supported_fields():
-            return self._song_file.get(attr, [''])[0]
+            if self._song_file is None and self._cached is not None:
+                return self._cached.get(attr, '')
+            return self._loaded_song_file().get(attr, [''])[0]
         else:
             result = self.__dict__.get(attr)
             if result is not None:
@@ -65,31 +110,114 @@ class Track(object):
     def __str__(self):
         return str(self.title)
 
+    def _load(self, song_file=None):
+        """Parses the file (or adopts a parsed one) and discards the cache"""
+        try:
+            if song_file is None and self._reader is not None:
+                song_file, self.bytes_read = self._reader(self.path)
+            elif song_file is None:
+                song_file = File(self.path, easy=True)
+        except MutagenError:
+            song_file = None
+
+        if song_file is None:
+            raise NotImplementedError(
+                "File not compatible: {}".format(self.path))
+
+        self._song_file = song_file
+        self._cached = None
+
+    def _loaded_song_file(self):
+        """The mutagen file of the Track, parsed first if need be"""
+        if self._song_file is None:
+            self._load()
+
+        return self._song_file
+
     def _update_file(self):
-        """Saves updated metadata to file."""
+        """Saves updated metadata to file, if any field has changed.
+
+        Returns True if the file was written.
+        """
+        if not self.dirty:
+            return False
+
         self._song_file.save()
+        self._original = {}
+        return True
 
     def reset_tags(self):
         """Reloads metadata from file."""
-        self._song_file.load(self.path)
+        if self._song_file is not None:
+            self._song_file.load(self.path)
+        self._original = {}
+
+    def changed_fields(self):
+        """List of the fields that differ from the values loaded from file"""
+        return [field for field, original in self._original.items()
+                if self._song_file.get(field) != original]
+
+    @property
+    def dirty(self):
+        """Whether any field differs from the value loaded from file"""
+        return bool(self.changed_fields())
 
     @property
     def length(self):
         """Track length in seconds"""
-        return self._song_file.info.length
+        if self._song_file is None and self._cached is not None:
+            return self._cached['length']
+        return self._loaded_song_file().info.length
 
     @property
     def bitrate(self):
         """Bitrate of song (eg. 160000)"""
-        return self._song_file.info.bitrate
+        if self._song_file is None and self._cached is not None:
+            return self._cached['bitrate']
+        return self._loaded_song_file().info.bitrate
+
+    @property
+    def content_hash(self):
+        """Hex SHA-1 of the file's audio, leaving out its tags
+
+        Files with the same audio share a content hash however they are
+        tagged (see library.audiohash). It is computed once per Track,
+        unless given with the cached values.
+        """
+        if self._content_hash is None:
+            if self._cached is not None:
+                self._content_hash = self._cached.get('audio_hash')
+            if self._content_hash is None:
+                self._content_hash = audio_hash(self.path)
+
+        return self._content_hash
 
     @property
     def fingerprint(self):
-        """Returns the Acoustid fingerprint"""
+        """Returns the Acoustid fingerprint
+
+        If Track.fingerprint_cache is set, fingerprints are looked up
+        there by the hash of the file's audio, and only computed (and
+        stored there) for audio not seen before.
+        """
         if self._fingerprint:
             return self._fingerprint
 
-        _, self._fingerprint = acoustid.fingerprint_file(self.path)
+        cache = self.fingerprint_cache
+        if cache is None:
+            _, self._fingerprint = acoustid.fingerprint_file(self.path)
+            return self._fingerprint
+
+        key = self.content_hash
+        cached = cache.lookup(key)
+
+        if cached is None:
+            duration, fingerprint = acoustid.fingerprint_file(self.path)
+            cache.store(key, duration, fingerprint)
+        else:
+            duration, fingerprint = cached
+
+        self._fingerprint = fingerprint
         return self._fingerprint
 
     @classmethod
@@ -0,0 +1,111 @@
+"""r3tagger.query.Local
+
+Requires: NumPy (http://numpy.org/)
+
+Identifies tracks from the fingerprints of a library that is already
+tagged, before querying Acoustid. A track that is a copy (or another rip)
+of a recording in the library is matched against its fingerprint
+locally, and the tags of the recording found make the release candidate,
+so only tracks unknown to the library are looked up remotely.
+
+Provides Functions:
+    build_index(albums:Albums, workers=None:int)
+    Fingerprints the tagged tracks of albums into a FingerprintIndex
+
+    identify(track:Track, index:FingerprintIndex)
+    Returns the Albums in the index that track is a recording from
+
+    get_releases(track:Track, index:FingerprintIndex, remote=True:bool)
+    Produces Albums for track from the index, or else from Acoustid
+
+    lookup_statistics
+    Counter of the tracks identified 'local'ly and the 'remote' lookups
+"""
+
+from collections import Counter
+
+from r3tagger import controller
+from r3tagger.model.album import Album
+from r3tagger.query import acoustid
+from r3tagger.library.similarity import FingerprintIndex
+
+
+# Counts of tracks identified 'local'ly and of 'remote' lookups made
+lookup_statistics = Counter()
+
+# Fields a track of the library needs to identify others
+_REQUIRED_FIELDS = ('artist', 'album', 'title')
+
+
+def _tagged(track):
+    return all(getattr(track, x) for x in _REQUIRED_FIELDS)
+
+
+def build_index(albums, workers=None):
+    """Returns a FingerprintIndex of the tagged tracks of albums
+
+    Each fingerprint is keyed on its (track, album). Tracks missing an
+    artist, album or title are left out. Tracks are fingerprinted as in
+    controller.fingerprint_albums, serially unless given workers.
+    """
+    album_of = {}
+    tagged = []
+    for album in albums:
+        tracks = [x for x in album if _tagged(x)]
+        for track in tracks:
+            album_of[id(track)] = album
+        tagged.append(tracks)
+
+    index = FingerprintIndex()
+    for track, fingerprint in controller.fingerprint_albums(tagged, workers):
+        if fingerprint:
+            index.add((track, album_of[id(track)]), fingerprint)
+
+    return index
+
+
+def _candidate(track, album):
+    """An Album of the tags of track, with the titles of its album"""
+    tags = dict((x, getattr(track, x)) for x in Album.supported_fields())
+    tags['tracks'] = [x.title for x in album]
+
+    return Album(tags)
+
+
+def identify(track, index, threshold=None):
+    """Returns Albums of the recordings in index that track matches
+
+    Albums are built from the tags of the tracks matched, best match
+    first, and each album of the library is given at most once. A track
+    is never matched with itself.
+    """
+    candidates = []
+    seen = set()
+
+    for score, (matched, album) in index.search(track.fingerprint,
+                                                threshold):
+        if matched.path == track.path or id(album) in seen:
+            continue
+        seen.add(id(album))
+        candidates.append(_candidate(matched, album))
+
+    return candidates
+
+
+def get_releases(track, index, remote=True):
+    """Produces release Albums for track, from the library where it can
+
+    As query.acoustid.get_releases, but a track identified in index (see
+    identify) is not looked up remotely. Otherwise, Acoustid is queried
+    unless remote is False.
+    """
+    candidates = identify(track, index)
+
+    if candidates:
+        lookup_statistics['local'] += 1
+        for album in candidates:
+            yield album
+    elif remote:
+        lookup_statistics['remote'] += 1
+        for album in acoustid.get_releases(track):
+            yield album
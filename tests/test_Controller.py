@@ -4,11 +4,14 @@ import shelve
 import shutil
 import os
 import tempfile
+import time
 
 import pytest
 
 from r3tagger import controller
+from r3tagger.library.index import TagIndex
 from r3tagger.model.album import Album
+from r3tagger.model.track import Track
 
 
 class TestCreateAlbum(object):
@@ -113,6 +116,36 @@ class TestCreateAlbum(object):
         for album in controller.build_albums(path, True):
             assert persist.match(album) == 1.0
 
+    def test_recursive_albums_parallel(self, path):
+        serial = list(controller.build_albums(path, True))
+        parallel = list(controller.build_albums(path, True, workers=2))
+
+        assert [x.path for x in parallel] == [x.path for x in serial]
+        for album, expected in zip(parallel, serial):
+            assert [x.path for x in album] == [x.path for x in expected]
+            assert album.artist == expected.artist
+
+    def test_scan_parses_each_file_once(self, path):
+        # test_songs/album holds 5 tracks, and 5 more in nested-album
+        list(controller.build_albums(path, True))
+
+        assert controller.scan_statistics['tracks'] == 10
+        assert controller.scan_statistics['parsed'] == 10
+
+    def test_scan_index_hits_not_parsed(self, path):
+        tempdir = tempfile.mkdtemp()
+        index = TagIndex(os.path.join(tempdir, 'index.db'))
+        try:
+            list(controller.build_albums(path, True, index=index))
+            assert controller.scan_statistics['parsed'] == 10
+
+            list(controller.build_albums(path, True, index=index))
+            assert controller.scan_statistics['cached'] == 10
+            assert controller.scan_statistics['parsed'] == 0
+        finally:
+            index.close()
+            shutil.rmtree(tempdir)
+
     def test_missing_album(self):
         with pytest.raises(controller.NoFileFoundError):
             controller.build_albums('.').next()
@@ -209,6 +242,27 @@ class TestAlbumManipulation():
             for track in album:
                 assert getattr(track, name) == tag
 
+    def test_retag_album_saves_once(self, album, monkeypatch):
+        saved = []
+        monkeypatch.setattr(Track, '_update_file',
+                            lambda track: saved.append(track.path))
+
+        titles = ['NewTitle{}'.format(x) for x in range(len(album.tracks))]
+        controller.retag_album(album, {'artist': 'NewArtist',
+                                       'tracks': titles})
+
+        assert sorted(saved) == sorted(x.path for x in album)
+        for track, title in zip(album, titles):
+            assert track.title == title
+            assert track.artist == 'NewArtist'
+
+    def test_commit_tracks_parallel(self, album):
+        controller.retag_album(album, {'genre': 'NewGenre'}, commit=False)
+        controller.commit_tracks(list(album) * 2, workers=2)
+
+        changed_album = controller.build_albums(album.path).next()
+        assert changed_album.genre == 'NewGenre'
+
     def test_retag_track(self, album):
         tags = {'artist': 'AnotherArtist', 'album': 'AnotherAlbum',
                 'date': '2013', 'genre': 'AnotherGenre'}
@@ -249,6 +303,14 @@ class TestAlbumManipulation():
         changed_album = controller.build_albums(path).next()
         assert changed_album.artist == artist
 
+    def test_flush_changes_skips_unchanged(self, album):
+        assert controller.flush_changes(album) == 0
+
+        album[0].artist = u'Foo'
+        album[1].artist = album[1].artist
+        assert controller.flush_changes(album, album[0]) == 1
+        assert controller.flush_changes(album) == 0
+
     def test_flush_changes_tracks(self, album):
         artist = u'Foo'
         tracks = []
@@ -291,3 +353,118 @@ def test_tags_by_frequency(album, fields):
     field, expected = fields
     controller.tags_by_frequency(album, field)
     assert list(controller.tags_by_frequency(album, field)) == expected
+
+
+def test_shared_tags_incremental(album):
+    shared = controller.SharedTags()
+    assert shared.result() is None
+
+    shared.add_track(album[0])
+    assert shared.result() == controller.get_fields(album[0])
+
+    for track in album[1:]:
+        shared.add_track(track)
+    assert shared.result() == controller.find_shared_tags(album)
+
+
+def test_find_shared_tags_across_albums(album):
+    first = controller.album_from_tracks(album[:2])
+    second = controller.album_from_tracks(album[2:])
+    assert (controller.find_shared_tags(first, second) ==
+            controller.find_shared_tags(album))
+
+
+@pytest.fixture
+def fingerprinted(monkeypatch):
+    """Fingerprints each path as itself, rather than running fpcalc"""
+    def fingerprint_file(path):
+        return 1.0, os.path.basename(path)
+
+    monkeypatch.setattr(controller.acoustid, 'fingerprint_file',
+                        fingerprint_file)
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_fingerprint_albums(album, fingerprinted, workers):
+    for track in album:
+        track._fingerprint = None
+    album[0]._fingerprint = 'known'
+
+    results = list(controller.fingerprint_albums([album], workers=workers))
+
+    assert sorted(x[0].path for x in results) == sorted(x.path for x in album)
+    for track, fingerprint in results:
+        assert track.fingerprint == fingerprint
+    assert album[0].fingerprint == 'known'
+    assert album[1].fingerprint == os.path.basename(album[1].path)
+
+
+def test_fingerprint_albums_as_finished(album, monkeypatch):
+    slow = album[0].path
+
+    def fingerprint_file(path):
+        if path == slow:
+            time.sleep(1)
+        return 1.0, os.path.basename(path)
+
+    monkeypatch.setattr(controller.acoustid, 'fingerprint_file',
+                        fingerprint_file)
+    for track in album:
+        track._fingerprint = None
+
+    results = list(controller.fingerprint_albums([album], workers=2))
+
+    assert len(results) == len(album.tracks)
+    assert results[-1][0] is album[0]
+
+
+def test_fingerprint_albums_raises_worker_errors(album, monkeypatch):
+    def fingerprint_file(path):
+        raise ValueError(path)
+
+    monkeypatch.setattr(controller.acoustid, 'fingerprint_file',
+                        fingerprint_file)
+    for track in album:
+        track._fingerprint = None
+
+    with pytest.raises(ValueError):
+        list(controller.fingerprint_albums([album], workers=2))
+
+
+def test_shared_tags_remove(album):
+    shared = controller.SharedTags()
+    shared.add(album)
+    shared.add_track(album[0])
+
+    shared.remove(album[1:])
+    assert album[0] in shared
+    assert shared.result() == controller.get_fields(album[0])
+
+    shared.remove_track(album[0])
+    assert shared.result() is None
+
+
+class _ReadFields(object):
+    """Stands in for a Track, recording each field read"""
+
+    def __init__(self, reads, **fields):
+        self._reads = reads
+        self._fields = fields
+
+    def __getattr__(self, field):
+        self._reads.append(field)
+        return self._fields[field]
+
+    @staticmethod
+    def supported_fields():
+        return ('artist', 'title')
+
+
+def test_find_shared_tags_stops_at_mismatch():
+    reads = []
+    tracks = [_ReadFields(reads, artist=u'Artist', title=x)
+              for x in (u'One', u'Two', u'Three')]
+
+    assert controller.find_shared_tags(tracks) == {'artist': u'Artist'}
+    assert reads.count('artist') == 3
+    assert reads.count('title') == 2
@@ -0,0 +1,76 @@
+"""Tests audio hashing and the fingerprint cache"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from r3tagger.model import track as track_module
+from r3tagger.model.track import Track
+from r3tagger.library.audiohash import audio_hash
+from r3tagger.library.fingerprint import FingerprintCache
+
+
+@pytest.fixture
+def temp_path(request):
+    path = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(path))
+    return path
+
+
+@pytest.fixture
+def cache(request, temp_path, monkeypatch):
+    fingerprints = FingerprintCache(os.path.join(temp_path, 'cache.db'))
+    monkeypatch.setattr(Track, 'fingerprint_cache', fingerprints)
+    request.addfinalizer(fingerprints.close)
+    return fingerprints
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    """Records the paths fingerprinted instead of running fpcalc"""
+    paths = []
+
+    def fingerprint_file(path):
+        paths.append(path)
+        return 1.0, 'FINGERPRINT'
+
+    monkeypatch.setattr(track_module.acoustid, 'fingerprint_file',
+                        fingerprint_file)
+    return paths
+
+
+@pytest.mark.parametrize('name', ['dummy.ogg', 'dummy.mp3', 'untagged.mp3'])
+def test_audio_hash_ignores_tags(temp_path, name):
+    path = os.path.join(temp_path, name)
+    shutil.copyfile(os.path.join('test_songs', name), path)
+    expected = audio_hash(path)
+
+    track = Track(path)
+    track.artist = u'A much longer artist name' * 100
+    track()
+
+    assert audio_hash(path) == expected
+    assert audio_hash(path) != audio_hash('test_songs/album/01.ogg')
+
+
+def test_cached_fingerprint_survives_retag(temp_path, cache, decoded):
+    path = os.path.join(temp_path, 'dummy.ogg')
+    shutil.copyfile('test_songs/dummy.ogg', path)
+
+    assert Track(path).fingerprint == 'FINGERPRINT'
+
+    track = Track(path)
+    track.title = u'Retitled'
+    track()
+
+    assert Track(path).fingerprint == 'FINGERPRINT'
+    assert decoded == [path]
+    assert cache.lookup(audio_hash(path)) == (1.0, 'FINGERPRINT')
+
+
+def test_fingerprint_without_cache(decoded):
+    assert Track('test_songs/dummy.ogg').fingerprint == 'FINGERPRINT'
+    assert Track('test_songs/dummy.ogg').fingerprint == 'FINGERPRINT'
+    assert len(decoded) == 2
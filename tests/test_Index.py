@@ -0,0 +1,256 @@
+"""Tests the TagIndex and building Albums from it"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from r3tagger import controller
+from r3tagger.model.track import Track
+from r3tagger.library.index import TagIndex
+
+
+@pytest.fixture
+def collection(request):
+    temp_path = tempfile.mkdtemp()
+    dest_path = os.path.join(temp_path, 'album')
+    shutil.copytree('test_songs/album', dest_path)
+
+    with open(os.path.join(dest_path, 'cover.jpg'), 'w') as cover:
+        cover.write('not audio')
+
+    def delete_tempfile():
+        shutil.rmtree(temp_path)
+
+    request.addfinalizer(delete_tempfile)
+    return dest_path
+
+
+@pytest.fixture
+def index(request, collection):
+    tag_index = TagIndex(os.path.join(os.path.dirname(collection),
+                                      'index.db'))
+    request.addfinalizer(tag_index.close)
+    return tag_index
+
+
+def _album_fields(albums):
+    return [[(x.path, controller.get_fields(x), x.length, x.bitrate)
+             for x in album] for album in albums]
+
+
+def test_first_scan_parses(collection, index):
+    albums = list(controller.build_albums(collection, True, index=index))
+
+    assert controller.scan_statistics['cached'] == 0
+    assert controller.scan_statistics['parsed'] == 10
+    assert len(albums) == 2
+
+
+def test_rescan_reads_index(collection, index):
+    expected = _album_fields(controller.build_albums(collection, True,
+                                                     index=index))
+    albums = list(controller.build_albums(collection, True, index=index))
+
+    assert controller.scan_statistics['parsed'] == 0
+    assert controller.scan_statistics['cached'] == 10
+    assert _album_fields(albums) == expected
+
+
+def test_rescan_parses_changed(collection, index):
+    list(controller.build_albums(collection, True, index=index))
+
+    track_path = os.path.join(collection, '01.ogg')
+    modified = os.stat(track_path).st_mtime + 10
+    os.utime(track_path, (modified, modified))
+
+    albums = list(controller.build_albums(collection, True, index=index))
+
+    assert controller.scan_statistics['parsed'] == 1
+    assert controller.scan_statistics['cached'] == 9
+    assert sum(len(x.tracks) for x in albums) == 10
+
+
+def test_parallel_scan_reads_index(collection, index):
+    list(controller.build_albums(collection, True, index=index))
+    albums = list(controller.build_albums(collection, True, workers=2,
+                                          index=index))
+
+    assert controller.scan_statistics['parsed'] == 0
+    assert sum(len(x.tracks) for x in albums) == 10
+
+
+def test_cached_track_writes(collection, index):
+    list(controller.build_albums(collection, False, index=index))
+    track = next(controller.build_albums(collection, False, index=index))[0]
+
+    track.artist = u'Foo'
+    track()
+
+    changed = controller.build_track(track.path)
+    assert changed.artist == u'Foo'
+
+
+def _age_directories(path):
+    """Moves directory mtimes out of the window rescans treat as racy"""
+    past = os.stat(path).st_mtime - 60
+    for root, _, _ in os.walk(path):
+        os.utime(root, (past, past))
+
+
+def test_rescan_added(collection, index):
+    deltas = list(controller.rescan_albums(collection, index))
+
+    assert [x.status for x in deltas] == ['added', 'added']
+    assert deltas[0].path == collection
+    assert len(deltas[0].album.tracks) == 5
+
+
+def test_rescan_skips_unchanged(collection, index):
+    _age_directories(collection)
+    list(controller.rescan_albums(collection, index))
+
+    assert list(controller.rescan_albums(collection, index)) == []
+    assert controller.scan_statistics['skipped'] == 2
+    assert controller.scan_statistics['parsed'] == 0
+
+
+def test_rescan_removed(collection, index):
+    _age_directories(collection)
+    list(controller.rescan_albums(collection, index))
+
+    nested = os.path.join(collection, 'nested-album')
+    shutil.rmtree(nested)
+    deltas = list(controller.rescan_albums(collection, index))
+
+    assert [(x.status, x.path) for x in deltas] == [('removed', nested)]
+    assert controller.scan_statistics['parsed'] == 0
+
+
+def test_rescan_removed_file(collection, index):
+    _age_directories(collection)
+    list(controller.rescan_albums(collection, index))
+
+    removed = os.path.join(collection, '05.ogg')
+    os.remove(removed)
+    deltas = list(controller.rescan_albums(collection, index))
+
+    assert [(x.status, x.path) for x in deltas] == [('changed', collection)]
+    assert len(deltas[0].album.tracks) == 4
+    assert controller.scan_statistics['parsed'] == 0
+
+    # Only the four remaining tracks were still indexed
+    assert index.prune_directory(collection, []) == 4
+
+
+def test_rescan_new_subtree(collection, index):
+    _age_directories(collection)
+    list(controller.rescan_albums(collection, index))
+
+    nested = os.path.join(collection, 'nested-album')
+    added = os.path.join(nested, 'another-album')
+    shutil.copytree('test_songs/mistagged', added)
+    deltas = list(controller.rescan_albums(collection, index))
+
+    assert [(x.status, x.path) for x in deltas] == [('added', added)]
+    assert controller.scan_statistics['skipped'] == 1
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_build_records_directories(collection, index, workers):
+    _age_directories(collection)
+    list(controller.build_albums(collection, True, workers, index=index))
+
+    assert list(controller.rescan_albums(collection, index)) == []
+    assert controller.scan_statistics['skipped'] == 2
+
+
+def test_refresh_after_build(collection, index):
+    _age_directories(collection)
+    list(controller.build_albums(collection, True, index=index))
+
+    assert list(controller.refresh_albums([collection], index)) == []
+    assert controller.scan_statistics['skipped'] == 1
+    assert controller.scan_statistics['parsed'] == 0
+
+
+def test_find_duplicates(collection, index):
+    albums = list(controller.build_albums(collection, True, index=index))
+
+    duplicates = controller.find_duplicates(albums, workers=2, index=index)
+
+    assert len(duplicates) == 1
+    assert sorted(x.path for x in duplicates[0]) == sorted(
+        x.path for album in albums for x in album)
+
+
+def test_duplicate_hashes_indexed(collection, index):
+    albums = list(controller.build_albums(collection, True, index=index))
+    expected = controller.find_duplicates(albums, index=index)[0][0]
+
+    albums = list(controller.build_albums(collection, True, index=index))
+    track = [x for album in albums for x in album
+             if x.path == expected.path][0]
+
+    assert track._cached['audio_hash'] == expected.content_hash
+
+
+def test_audio_changed(collection, index):
+    albums = list(controller.build_albums(collection, True, index=index))
+    tracks = [x for album in albums for x in album]
+    assert controller.audio_changed(tracks, index) == []
+
+    retagged = os.path.join(collection, '01.ogg')
+    replaced = os.path.join(collection, '02.ogg')
+    controller.retag_track(Track(retagged), {'title': u'New'})
+    shutil.copy('test_songs/dummy.ogg', replaced)
+
+    albums = list(controller.build_albums(collection, True, index=index))
+    tracks = [x for album in albums for x in album]
+
+    assert [x.path for x in controller.audio_changed(tracks, index)] == [
+        replaced]
+
+
+def test_lazy_build_parses_nothing(collection):
+    expected = list(controller.build_albums(collection, True))
+    albums = list(controller.build_albums(collection, True, lazy=True))
+
+    assert controller.scan_statistics['parsed'] == 0
+    tracks = [x for album in albums for x in album]
+    assert len(tracks) == 10
+    assert all(x._song_file is None for x in tracks)
+    assert all(x.stat.st_size == os.path.getsize(x.path) for x in tracks)
+
+    assert [x.album for x in albums] == [x.album for x in expected]
+    assert _album_fields(albums) == _album_fields(expected)
+
+
+def test_lazy_album_drops_unsupported(collection):
+    shutil.copy('test_songs/Unsupported.file',
+                os.path.join(collection, '06.mp3'))
+    album = next(controller.build_albums(collection, lazy=True))
+
+    assert len(album.tracks) == 6
+    assert album.artist
+    assert len(album.tracks) == 5
+
+
+def test_lazy_build_fills_index(collection, index):
+    list(controller.build_albums(collection, True, index=index, lazy=True))
+    assert controller.scan_statistics['parsed'] == 10
+
+    list(controller.build_albums(collection, True, index=index, lazy=True))
+    assert controller.scan_statistics['parsed'] == 0
+    assert controller.scan_statistics['cached'] == 10
+
+
+def test_lazy_build_reads_index(collection, index):
+    list(controller.build_albums(collection, True, index=index))
+    albums = list(controller.build_albums(collection, True, workers=2,
+                                          index=index, lazy=True))
+
+    assert controller.scan_statistics['parsed'] == 0
+    assert controller.scan_statistics['cached'] == 10
+    assert all(x.stat is not None for album in albums for x in album)
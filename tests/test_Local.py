@@ -0,0 +1,80 @@
+"""Tests identifying tracks from the fingerprints of the library"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from r3tagger import controller
+from r3tagger.model.track import Track
+from r3tagger.query import local
+from r3tagger.library.similarity import FingerprintIndex
+
+
+@pytest.fixture
+def fingerprint(monkeypatch):
+    """Fingerprints every file as the public domain song"""
+    with open('test_songs/PublicDomainFingerprint.txt') as fingerprint:
+        text = fingerprint.read().strip()
+
+    monkeypatch.setattr(controller.acoustid, 'fingerprint_file',
+                        lambda path: (1.0, text))
+    return text
+
+
+@pytest.fixture
+def unknown(request):
+    temp_path = tempfile.mkdtemp()
+    path = os.path.join(temp_path, 'unknown.ogg')
+    shutil.copy('test_songs/album/01.ogg', path)
+    request.addfinalizer(lambda: shutil.rmtree(temp_path))
+
+    return Track(path, fields={})
+
+
+@pytest.fixture
+def library():
+    return next(controller.build_albums('test_songs/album'))
+
+
+def test_identify(fingerprint, unknown, library):
+    index = local.build_index([library], workers=None)
+
+    candidates = local.identify(unknown, index)
+
+    assert len(index) == len(library.tracks)
+    assert len(candidates) == 1
+    assert candidates[0].album == library[0].album
+    assert candidates[0].tracks == [x.title for x in library]
+
+
+def test_identify_skips_itself(fingerprint, library):
+    index = local.build_index([library[:1]], workers=None)
+
+    assert local.identify(library[0], index) == []
+
+
+def test_get_releases_local(fingerprint, unknown, library, monkeypatch):
+    monkeypatch.setattr(local.acoustid, 'get_releases', None)
+    index = local.build_index([library], workers=None)
+    local.lookup_statistics.clear()
+
+    releases = list(local.get_releases(unknown, index))
+
+    assert len(releases) == 1
+    assert local.lookup_statistics == {'local': 1}
+
+
+def test_get_releases_remote(fingerprint, unknown, monkeypatch):
+    monkeypatch.setattr(local.acoustid, 'get_releases',
+                        lambda track: iter(['remote']))
+    local.lookup_statistics.clear()
+
+    assert list(local.get_releases(unknown, FingerprintIndex())) == [
+        'remote']
+    assert list(local.get_releases(unknown, FingerprintIndex(),
+                                   remote=False)) == []
+    assert local.lookup_statistics == {'remote': 1}
@@ -0,0 +1,50 @@
+"""Tests scoring Albums with library.match"""
+
+from r3tagger.model.album import Album
+from r3tagger.library import match
+
+
+def _album(album=u'SomeAlbum', tracks=None):
+    return Album({'album': album, 'artist': u'SomeArtist', 'date': u'2012',
+                  'tracks': tracks or [u'Intro', u'Second Song']})
+
+
+def test_normalize():
+    assert match.normalize(u'Caf\xe9 - Live!') == u'cafe live'
+    assert match.normalize('AC/DC') == u'ac dc'
+    assert match.normalize(u'Stra\xdfe') == u'strasse'
+
+
+def test_normalized_values_match():
+    local = _album(u'The Album (Remastered)', [u'Intro', u'Second Song'])
+    candidate = _album(u'the album remastered', [u'INTRO', u'Second song!'])
+
+    assert local.match(candidate) == 1.0
+
+
+def test_near_matches_count_in_part():
+    local = _album(tracks=[u'Intro', u'Second Song'])
+    candidate = _album(tracks=[u'Intro', u'Second Songs'])
+
+    assert 0.9 < local.match(candidate) < 1.0
+    assert match.similarity(local, candidate, threshold=1) == 2.0 / 3
+
+
+def test_rank_candidates():
+    local = _album()
+    candidates = [_album(u'Other'), _album(), _album(u'SomeAlbums')]
+    matcher = match.Matcher(local)
+
+    ranked = matcher.rank(candidates)
+    assert [x[1] for x in ranked] == [candidates[1], candidates[2],
+                                      candidates[0]]
+    assert matcher.scores(candidates) == [x.match(local) for x in candidates]
+
+
+def test_cache_follows_changes():
+    local = _album()
+    candidate = _album()
+    assert local.match(candidate) == 1.0
+
+    candidate.artist = u'Someone Else'
+    assert local.match(candidate) < 1.0
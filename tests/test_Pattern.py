@@ -0,0 +1,53 @@
+"""Tests compiled naming patterns"""
+
+from r3tagger.model.album import Album
+from r3tagger.library import pattern
+
+
+def test_format_album():
+    album = Album({'artist': u'SomeArtist', 'date': u'2012',
+                   'album': u'SomeAlbum'})
+    compiled = pattern.compile_pattern('{date} - {album}')
+
+    assert sorted(compiled.fields) == ['album', 'date']
+    assert compiled.format(album) == u'2012 - SomeAlbum'
+    assert pattern.compile_pattern('{date} - {album}') is compiled
+
+
+def test_format_spec_and_suffix():
+    album = Album({'artist': u'Artist', 'date': u'7'})
+    compiled = pattern.PathPattern('{date:0>2} - {artist!s}')
+
+    assert compiled.format(album, '.ogg') == u'07 - Artist.ogg'
+
+
+def test_sanitize():
+    assert pattern.sanitize(u'AC/DC') == u'AC_DC'
+    assert pattern.sanitize(u' Back\\Slash\x00\n ') == u'Back_Slash__'
+    assert pattern.sanitize(u'..') == u'__'
+
+
+def test_long_names_keep_suffix():
+    album = Album({'album': u'\xe9' * 300})
+    name = pattern.PathPattern('{album}').format(album, '.flac')
+
+    assert name.endswith(u'.flac')
+    assert len(name.encode('utf-8')) <= pattern.MAX_NAME_BYTES
+
+
+def test_non_ascii_byte_suffix():
+    album = Album({'album': u'\xe9' * 300})
+    name = pattern.PathPattern('{album}').format(album, '.\xc3\xa9')
+
+    assert name.endswith(u'.\xe9')
+    assert len(name.encode('utf-8')) <= pattern.MAX_NAME_BYTES
+
+
+def test_empty_names_unknown():
+    album = Album({'artist': u'', 'album': u'\x00'})
+    compiled = pattern.PathPattern('{artist} - {album}')
+
+    assert compiled.format(album) == u' - _'
+    assert pattern.PathPattern('{date}').format(album) == pattern.UNKNOWN
+    assert pattern.PathPattern('{date}').format(album, '.ogg') == (
+        pattern.UNKNOWN + u'.ogg')
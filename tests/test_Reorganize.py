@@ -1,9 +1,12 @@
+import os
 import shutil
 import tempfile
 import re
 from os import path
 
-from r3tagger import controller
+import pytest
+
+from r3tagger import controller, FileExistsError
 from r3tagger.model.album import Album
 from r3tagger.library import reorganize
 
@@ -147,3 +150,215 @@ class TestReorganize():
         for track_path in [pattern.format(x, x) for x in range(5, 0, -1)]:
             assert path.isfile(track_path)
             assert path.dirname(track_path) == destination
+
+
+@pytest.fixture
+def collection(request):
+    temp_path = tempfile.mkdtemp()
+    album_path = path.join(temp_path, 'album')
+    shutil.copytree('test_songs/album/nested-album', album_path)
+
+    with open(path.join(album_path, 'cover.jpg'), 'w') as cover:
+        cover.write('cover')
+
+    def delete_tempfile():
+        shutil.rmtree(temp_path)
+
+    request.addfinalizer(delete_tempfile)
+    return temp_path
+
+
+def test_plan_reorganization_leaves_disc(collection):
+    albums = list(controller.build_albums(collection, True))
+    plan = reorganize.plan_reorganization(albums, collection)
+
+    album = albums[0]
+    expected = path.join(collection, album.artist,
+                         '{} - {}'.format(album.date, album.album))
+    assert plan[0].destination == expected
+    assert [x.source for x in plan[0].moves[:5]] == [x.path for x in album]
+    assert plan[0].moves[-1] == (path.join(album.path, 'cover.jpg'),
+                                 path.join(expected, 'cover.jpg'))
+    assert path.isdir(album.path)
+    assert not path.exists(expected)
+
+
+def test_plan_album_in_collection_root(collection):
+    album_path = path.join(collection, 'album')
+    album = next(controller.build_albums(album_path))
+    plan = reorganize.plan_album(album, album_path)
+
+    assert [x.source for x in plan.moves] == [x.path for x in album]
+
+
+def test_reorganize_renames_in_place(collection):
+    album = next(controller.build_albums(path.join(collection, 'album')))
+    inodes = sorted(os.stat(x.path).st_ino for x in album)
+
+    reorganize.reorganize_and_rename_collection(collection,
+                                                include_only=album)
+
+    assert sorted(os.stat(x.path).st_ino for x in album) == inodes
+    assert path.isfile(path.join(album.path, 'cover.jpg'))
+    assert not path.exists(path.join(collection, 'album'))
+
+
+def test_dry_run_finds_collisions(collection):
+    album = next(controller.build_albums(path.join(collection, 'album')))
+    for track in album:
+        track.title = u'Same' if track.tracknumber < u'03' else u'SAME'
+        track.tracknumber = u'01'
+
+    plan, collisions = reorganize.reorganize_and_rename_collection(
+        collection, include_only=album, dry_run=True)
+
+    assert len(collisions) == 1
+    assert sorted(collisions[0].sources) == sorted(x.path for x in album)
+    assert len(list(reorganize.describe_plan(plan, collisions))) == 7
+    assert path.isfile(album[0].path)
+
+
+def test_collisions_with_existing_files(collection):
+    album = next(controller.build_albums(path.join(collection, 'album')))
+    plan = reorganize.plan_reorganization([album], collection, 'TRACK')
+    occupied = plan[0].moves[0].destination
+    with open(occupied, 'w') as existing:
+        existing.write('occupied')
+
+    collisions = reorganize.find_collisions(plan)
+    assert [(x.destination, x.existing) for x in collisions] == [
+        (occupied, True)]
+
+    with pytest.raises(FileExistsError):
+        reorganize.reorganize_and_rename_collection(
+            collection, organization_pattern='TRACK', include_only=album)
+    assert path.isfile(album[0].path)
+
+
+def test_apply_plan_parallel(collection):
+    nested = path.join(collection, 'album', 'nested')
+    shutil.copytree('test_songs/album/nested-album', nested)
+    albums = list(controller.build_albums(collection, True))
+    controller.retag_album(albums[1], {'album': u'NestedAlbum'})
+    plan = reorganize.plan_reorganization(albums, collection, 'ALBUM/TRACK',
+                                          album_pattern='{album}')
+
+    reorganize.apply_plan(plan, collection, workers=4)
+
+    for album in albums:
+        assert path.dirname(album.path) == collection
+        assert all(path.isfile(x.path) for x in album)
+    assert sorted(os.listdir(collection)) == sorted(x.album for x in albums)
+
+
+def test_resume_reorganization(collection, monkeypatch):
+    album = next(controller.build_albums(path.join(collection, 'album')))
+    plan = reorganize.plan_reorganization([album], collection)
+    journal = path.join(tempfile.mkdtemp(), 'journal')
+
+    moved = []
+    move_file = reorganize._move_file
+
+    def interrupted_move(source, destination):
+        if len(moved) == 3:
+            raise KeyboardInterrupt
+        move_file(source, destination)
+        moved.append(destination)
+    monkeypatch.setattr(reorganize, '_move_file', interrupted_move)
+
+    with pytest.raises(KeyboardInterrupt):
+        reorganize.apply_plan(plan, collection, journal=journal)
+
+    monkeypatch.setattr(reorganize, '_move_file', move_file)
+    assert reorganize.resume_reorganization(journal) == 3
+    assert reorganize.resume_reorganization(journal) == 0
+
+    for move in plan[0].moves:
+        assert path.isfile(move.destination)
+    assert not path.exists(path.join(collection, 'album'))
+    shutil.rmtree(path.dirname(journal))
+
+
+def test_resume_reused_journal(collection, monkeypatch):
+    journal = path.join(tempfile.mkdtemp(), 'journal')
+    album = next(controller.build_albums(path.join(collection, 'album')))
+    first = reorganize.plan_reorganization([album], collection, 'ALBUM',
+                                           album_pattern='{album}')
+    reorganize.apply_plan(first, collection, journal=journal)
+
+    album = next(controller.build_albums(first[0].destination))
+    plan = reorganize.plan_reorganization([album], collection)
+
+    moved = []
+    move_file = reorganize._move_file
+
+    def interrupted_move(source, destination):
+        if len(moved) == 3:
+            raise KeyboardInterrupt
+        move_file(source, destination)
+        moved.append(destination)
+    monkeypatch.setattr(reorganize, '_move_file', interrupted_move)
+
+    with pytest.raises(KeyboardInterrupt):
+        reorganize.apply_plan(plan, collection, journal=journal)
+
+    monkeypatch.setattr(reorganize, '_move_file', move_file)
+    assert reorganize.resume_reorganization(journal) == 3
+
+    for move in plan[0].moves:
+        assert path.isfile(move.destination)
+    assert not path.exists(first[0].destination)
+    shutil.rmtree(path.dirname(journal))
+
+
+def test_resume_interrupted_copy(collection, monkeypatch):
+    album = next(controller.build_albums(path.join(collection, 'album')))
+    plan = reorganize.plan_reorganization([album], collection)
+    journal = path.join(tempfile.mkdtemp(), 'journal')
+
+    moved = []
+    move_file = reorganize._move_file
+
+    def interrupted_move(source, destination):
+        if len(moved) == 3:
+            # Copied into place, but the source was never removed
+            shutil.copy2(source, destination)
+            raise KeyboardInterrupt
+        move_file(source, destination)
+        moved.append(destination)
+    monkeypatch.setattr(reorganize, '_move_file', interrupted_move)
+
+    with pytest.raises(KeyboardInterrupt):
+        reorganize.apply_plan(plan, collection, journal=journal)
+
+    monkeypatch.setattr(reorganize, '_move_file', move_file)
+    assert reorganize.resume_reorganization(journal) == 3
+    assert reorganize.resume_reorganization(journal) == 0
+
+    for move in plan[0].moves:
+        assert path.isfile(move.destination)
+        assert not path.exists(move.source)
+    shutil.rmtree(path.dirname(journal))
+
+
+def test_link_collection(collection):
+    source = path.join(collection, 'album')
+    view = path.join(collection, 'view')
+    album = next(controller.build_albums(source))
+    paths = sorted(os.listdir(source))
+
+    assert reorganize.link_collection([album], view) == (6, 0)
+
+    plan = reorganize.plan_reorganization([album], view)
+    for move in plan[0].moves:
+        assert os.stat(move.destination).st_ino == os.stat(move.source).st_ino
+    assert sorted(os.listdir(source)) == paths
+
+    assert reorganize.link_collection([album], view) == (0, 0)
+
+    controller.retag_album(album, {'album': u'Renamed'})
+    assert reorganize.link_collection([album], view, symbolic=True) == (6, 6)
+    assert path.islink(path.join(view, album.artist, u'2012 - Renamed',
+                                 'cover.jpg'))
+    assert not path.exists(path.join(view, album.artist,
+                                     u'2012 - SomeAlbum'))
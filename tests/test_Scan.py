@@ -0,0 +1,126 @@
+"""Tests finding audio files with library.scan"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from r3tagger import controller
+from r3tagger.library import scan
+
+
+@pytest.fixture
+def collection(request):
+    temp_path = tempfile.mkdtemp()
+    dest_path = os.path.join(temp_path, 'album')
+    shutil.copytree('test_songs/album', dest_path)
+
+    with open(os.path.join(dest_path, 'cover.jpg'), 'w') as cover:
+        cover.write('not audio')
+    with open(os.path.join(dest_path, 'notes'), 'w') as notes:
+        notes.write('not audio either')
+    shutil.copyfile('test_songs/dummy.ogg', os.path.join(dest_path, '06'))
+
+    def delete_tempfile():
+        shutil.rmtree(temp_path)
+
+    request.addfinalizer(delete_tempfile)
+    return dest_path
+
+
+def test_is_audio_by_extension(collection, monkeypatch):
+    def sniff(path):
+        raise AssertionError('Opened {}'.format(path))
+    monkeypatch.setattr(scan, '_sniff', sniff)
+
+    assert scan.is_audio(os.path.join(collection, '01.ogg'))
+    assert scan.is_audio(os.path.join(collection, '01.OGG'))
+    assert not scan.is_audio(os.path.join(collection, 'cover.jpg'))
+
+
+def test_is_audio_sniffs_unknown(collection):
+    assert scan.is_audio(os.path.join(collection, '06'))
+    assert not scan.is_audio(os.path.join(collection, 'notes'))
+    assert scan.is_audio('test_songs/PublicDomainSong.mp3', extensions=())
+    assert not scan.is_audio('test_songs/Unsupported.file')
+
+
+def test_list_directory(collection):
+    subdirectories, names = scan.list_directory(collection)
+
+    assert subdirectories == [os.path.join(collection, 'nested-album')]
+    assert sorted(names) == ['01.ogg', '02.ogg', '03.ogg', '04.ogg',
+                             '05.ogg', '06']
+
+
+def test_list_directory_extensions(collection, monkeypatch):
+    sniffed = []
+    monkeypatch.setattr(scan, '_sniff',
+                        lambda path: sniffed.append(os.path.basename(path)))
+
+    scan.list_directory(collection)
+    assert sorted(sniffed) == ['06', 'notes']
+
+    del sniffed[:]
+    scan.list_directory(collection, extensions=('.mp3',))
+    assert sorted(sniffed) == ['01.ogg', '02.ogg', '03.ogg', '04.ogg',
+                               '05.ogg', '06', 'notes']
+
+
+def test_walk_matches_os_walk(collection):
+    expected = [x[0] for x in os.walk(collection)]
+    assert [x[0] for x in scan.walk(collection)] == expected
+
+
+@pytest.mark.parametrize('use_scandir', [True, False])
+def test_walk_skips_directory_links(collection, monkeypatch, use_scandir):
+    if use_scandir and scan.scandir is None:
+        pytest.skip('scandir is not available')
+    elif not use_scandir:
+        monkeypatch.setattr(scan, 'scandir', None)
+    nested = os.path.join(collection, 'nested-album')
+    os.symlink('..', os.path.join(nested, 'back'))
+
+    assert [x[0] for x in scan.walk(collection)] == [collection, nested]
+
+
+def test_build_albums_skips_non_audio(collection):
+    albums = list(controller.build_albums(collection, True))
+
+    assert len(albums[0].tracks) == 6
+    assert controller.scan_statistics['parsed'] == 11
+
+
+def test_tag_reader_bounds_reads():
+    path = 'test_songs/PublicDomainSong.mp3'
+    size = os.path.getsize(path)
+
+    with scan.TagReader(path, head_size=16, tail_size=16) as reader:
+        with open(path, 'rb') as audio:
+            assert reader.read(4) == audio.read(4)
+            reader.seek(-8, 2)
+            audio.seek(-8, 2)
+            assert reader.read() == audio.read()
+            reader.seek(100)
+            audio.seek(100)
+            assert reader.read(8) == audio.read(8)
+
+        assert reader.tell() == 108
+        assert reader.bytes_read == 16 + 16 + 8
+        assert reader.bytes_read < size
+
+
+def test_build_albums_counts_bytes(collection):
+    album = next(controller.build_albums(collection, scan=True))
+
+    assert all(x.bytes_read for x in album)
+    assert (controller.scan_statistics['bytes'] ==
+            sum(x.bytes_read for x in album))
+
+
+def test_build_albums_parses_whole_files(collection):
+    album = next(controller.build_albums(collection))
+
+    assert all(x.bytes_read is None for x in album)
+    assert controller.scan_statistics['bytes'] == 0
@@ -0,0 +1,96 @@
+"""Tests decoding fingerprints and finding near matches among them"""
+
+import base64
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from r3tagger import controller
+from r3tagger.library.similarity import FingerprintIndex, decode_fingerprint
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _fingerprint(seed, size=400):
+    random = numpy.random.RandomState(seed)
+    return random.randint(0, 1 << 32, size, dtype=numpy.uint64).astype(
+        numpy.uint32)
+
+
+def _noisy(fingerprint, seed, rate=0.05):
+    """A copy of fingerprint with about rate of its bits flipped"""
+    random = numpy.random.RandomState(seed)
+    flipped = random.rand(len(fingerprint), 32) < rate
+    mask = flipped.dot(numpy.uint64(1) << numpy.arange(32, dtype=numpy.uint64))
+    return fingerprint ^ mask.astype(numpy.uint32)
+
+
+@pytest.mark.parametrize('data, expected', [
+    ('\0\0\0\1\1', [1]),
+    ('\0\0\0\1\x49\0', [7]),
+    ('\0\0\0\1\x07\0', [1 << 6]),
+    ('\0\0\0\1\x07\x02', [1 << 8]),
+    ('\0\0\0\2\x41\0', [1, 0]),
+    ('\0\0\0\2\x01\0', [1, 1])])
+def test_decode_fingerprint(data, expected):
+    assert list(decode_fingerprint(_encode(data))) == expected
+
+
+def test_decode_fingerprint_file():
+    with open('test_songs/PublicDomainFingerprint.txt') as fingerprint:
+        items = decode_fingerprint(fingerprint.read().strip())
+
+    assert items.dtype == numpy.uint32
+    assert len(items) == 948
+
+
+def test_decode_truncated():
+    with pytest.raises(ValueError):
+        decode_fingerprint(_encode('\0\0\0\3\1'))
+
+
+def test_search():
+    original = _fingerprint(1)
+    index = FingerprintIndex()
+    index.add('copy', _noisy(original, 2))
+    index.add('other', _fingerprint(3))
+
+    matches = index.search(original)
+
+    assert [x[1] for x in matches] == ['copy']
+    assert 0.9 < matches[0][0] < 1
+
+
+def test_clusters():
+    first = _fingerprint(1)
+    second = _fingerprint(2)
+
+    index = FingerprintIndex()
+    index.add('first', first)
+    index.add('second', second)
+    index.add('alone', _fingerprint(3))
+    index.add('first noisy', _noisy(first, 4))
+    index.add('first shifted', _noisy(first[1:], 5))
+    index.add('second noisy', _noisy(second, 6))
+
+    clusters = sorted(sorted(x) for x in index.clusters())
+
+    assert clusters == [['first', 'first noisy', 'first shifted'],
+                        ['second', 'second noisy']]
+
+
+def test_find_near_duplicates(monkeypatch):
+    with open('test_songs/PublicDomainFingerprint.txt') as fingerprint:
+        text = fingerprint.read().strip()
+
+    monkeypatch.setattr(controller.acoustid, 'fingerprint_file',
+                        lambda path: (1.0, text))
+    album = next(controller.build_albums('test_songs/album'))
+
+    duplicates = controller.find_near_duplicates([album], workers=None)
+
+    assert [[x.path for x in cluster] for cluster in duplicates] == [
+        sorted(x.path for x in album)]
@@ -0,0 +1,77 @@
+"""Tests the TrackStore"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from r3tagger import controller
+from r3tagger.model.store import TrackStore
+
+
+@pytest.fixture(scope='module')
+def collection(request):
+    temp_path = tempfile.mkdtemp()
+    dest_path = os.path.join(temp_path, 'album')
+    shutil.copytree('test_songs/album', dest_path)
+
+    def delete_tempfile():
+        shutil.rmtree(temp_path)
+
+    request.addfinalizer(delete_tempfile)
+    return dest_path
+
+
+@pytest.fixture
+def albums(collection):
+    return list(controller.build_albums(collection, True))
+
+
+def _values(track):
+    return (track.path, controller.get_fields(track), track.length,
+            track.bitrate)
+
+
+def test_rows_match_tracks(albums):
+    store = TrackStore()
+    store.extend(albums)
+
+    tracks = [x for album in albums for x in album]
+    assert len(store) == len(tracks)
+    for row, track in enumerate(tracks):
+        assert _values(store.track(row)) == _values(track)
+
+
+def test_albums_match(albums):
+    store = TrackStore()
+    store.extend(albums)
+
+    for album, expected in zip(store.albums(), albums):
+        assert album.path == expected.path
+        assert controller.get_fields(album) == controller.get_fields(expected)
+        assert [_values(x) for x in album] == [_values(x) for x in expected]
+
+
+def test_irregular_numbers(albums):
+    track = albums[0][0]
+    store = TrackStore()
+
+    for tracknumber in (u'3/12', u'', u'007'):
+        track.tracknumber = tracknumber
+        row = store.append(track)
+        assert store.value(row, 'tracknumber') == tracknumber
+
+    track.reset_tags()
+
+
+def test_view_writes_file(albums):
+    store = TrackStore()
+    store.extend(albums)
+
+    view = store.track(0)
+    view.genre = u'Foo'
+    view()
+
+    assert controller.build_track(view.path).genre == u'Foo'
+    assert store.value(0, 'genre') == albums[0][0].genre
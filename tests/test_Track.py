@@ -4,6 +4,7 @@ import os
 import pytest
 
 from r3tagger.model.track import Track
+from r3tagger.library.scan import read_tags
 
 
 class TestWriteTrack(object):
@@ -234,3 +235,51 @@ def untagged_mp3_path(request):
 
 def test_instantiate_untagged_mp3(untagged_mp3_path):
     Track(untagged_mp3_path)
+
+
+def test_lazy_track_reads_on_access():
+    path = os.path.join('test_songs', 'album', '01.ogg')
+    track = Track(path, lazy=True)
+    expected = Track(path)
+
+    assert track.title == expected.title
+    assert track.length == expected.length
+
+
+def test_lazy_track_unsupported():
+    track = Track(os.path.join('test_songs', 'Unsupported.file'), lazy=True)
+    with pytest.raises(NotImplementedError):
+        track.title
+
+
+def test_dirty_tracking(untagged_mp3_path):
+    track = Track(untagged_mp3_path)
+    assert not track.dirty
+    assert track() is False
+
+    track.artist = u'Foo'
+    assert track.changed_fields() == ['artist']
+    assert track() is True
+    assert not track.dirty
+
+    track.artist = u'Bar'
+    track.artist = u'Foo'
+    assert not track.dirty
+
+
+def test_scan_track_reads_tags():
+    path = os.path.join('test_songs', 'PublicDomainSong.mp3')
+    track = Track(path, reader=read_tags)
+    expected = Track(path)
+
+    assert track.title == expected.title
+    assert track.length == expected.length
+    assert 0 < track.bytes_read < os.path.getsize(path) / 10
+
+
+def test_scan_track_saves(untagged_mp3_path):
+    track = Track(untagged_mp3_path, reader=read_tags)
+    track.artist = u'Scanned'
+    assert track() is True
+
+    assert Track(untagged_mp3_path).artist == u'Scanned'
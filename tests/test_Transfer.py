@@ -0,0 +1,90 @@
+"""Tests moving files and albums with library.transfer"""
+
+import os
+import errno
+import shutil
+import tempfile
+
+import pytest
+
+from r3tagger.library import transfer
+
+
+@pytest.fixture
+def album_path(request):
+    temp_path = tempfile.mkdtemp()
+    dest_path = os.path.join(temp_path, 'album')
+    shutil.copytree('test_songs/album', dest_path)
+
+    def delete_tempfile():
+        shutil.rmtree(temp_path)
+
+    request.addfinalizer(delete_tempfile)
+    return dest_path
+
+
+@pytest.fixture
+def other_device(request, album_path):
+    """A directory on another filesystem, where one is available"""
+    shm = '/dev/shm'
+    if (not os.path.isdir(shm) or
+            os.stat(shm).st_dev == os.stat(album_path).st_dev):
+        pytest.skip('No second filesystem to move to')
+
+    temp_path = tempfile.mkdtemp(dir=shm)
+    request.addfinalizer(lambda: shutil.rmtree(temp_path))
+    return temp_path
+
+
+def _contents(path):
+    with open(path, 'rb') as data:
+        return data.read()
+
+
+def test_copy_file(album_path):
+    source = os.path.join(album_path, '01.ogg')
+    destination = os.path.join(album_path, 'copy.ogg')
+
+    method = transfer.copy_file(source, destination)
+
+    assert method in ('reflink', 'copy_file_range', 'sendfile', 'userspace')
+    assert _contents(destination) == _contents(source)
+    # copystat only carries the time to the microsecond
+    assert (int(os.stat(destination).st_mtime) ==
+            int(os.stat(source).st_mtime))
+
+
+def test_move_file_across_filesystems(album_path, monkeypatch):
+    source = os.path.join(album_path, '01.ogg')
+    destination = os.path.join(album_path, 'moved.ogg')
+    expected = _contents(source)
+    rename = os.rename
+
+    def cross_device_rename(old, new):
+        if old == source:
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        rename(old, new)
+    monkeypatch.setattr(os, 'rename', cross_device_rename)
+
+    transfer.move_file(source, destination, checksum=True)
+
+    assert not os.path.exists(source)
+    assert _contents(destination) == expected
+    assert not os.path.exists(destination + '.r3tagger-part')
+
+
+def test_move_albums_to_other_device(album_path, other_device):
+    destination = os.path.join(other_device, 'album')
+    expected = dict((x, _contents(os.path.join(album_path, x)))
+                    for x in os.listdir(album_path) if x.endswith('.ogg'))
+    sizes = [os.path.getsize(os.path.join(root, x))
+             for root, _, files in os.walk(album_path) for x in files]
+
+    report = transfer.move_albums([(album_path, destination)], workers=2)
+
+    assert report.files == len(sizes)
+    assert report.bytes == sum(sizes)
+    assert report.throughput > 0
+    assert not os.path.exists(album_path)
+    for name, data in expected.items():
+        assert _contents(os.path.join(destination, name)) == data
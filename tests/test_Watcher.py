@@ -0,0 +1,85 @@
+"""Tests the CollectionWatcher"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+from r3tagger.library.index import TagIndex
+from r3tagger.library.watcher import CollectionWatcher
+
+
+class Batches(object):
+    """Records the batches reported by a watcher"""
+
+    def __init__(self):
+        self.batches = []
+        self.reported = threading.Event()
+
+    def __call__(self, deltas):
+        self.batches.append(deltas)
+        self.reported.set()
+
+
+@pytest.fixture
+def watched(request):
+    temp_path = tempfile.mkdtemp()
+    collection = os.path.join(temp_path, 'collection')
+    os.mkdir(collection)
+
+    batches = Batches()
+    watcher = CollectionWatcher(TagIndex(os.path.join(temp_path, 'index.db')),
+                                batches, delay=0.5)
+    watcher.watch(collection)
+    watcher.start()
+
+    def stop_watcher():
+        watcher.stop()
+        watcher.index.close()
+        shutil.rmtree(temp_path)
+
+    request.addfinalizer(stop_watcher)
+    return collection, batches
+
+
+def test_new_album_reported_once(watched):
+    collection, batches = watched
+    album_path = os.path.join(collection, 'album')
+    shutil.copytree('test_songs/mistagged', album_path)
+
+    assert batches.reported.wait(10)
+    deltas = [x for batch in batches.batches for x in batch]
+    assert [(x.status, x.path) for x in deltas] == [('added', album_path)]
+    assert len(deltas[0].album.tracks) == 5
+
+
+def test_deleted_album_reported(watched):
+    collection, batches = watched
+    album_path = os.path.join(collection, 'album')
+    shutil.copytree('test_songs/mistagged', album_path)
+    assert batches.reported.wait(10)
+
+    batches.reported.clear()
+    shutil.rmtree(album_path)
+
+    assert batches.reported.wait(10)
+    assert [(x.status, x.path) for x in batches.batches[-1]] == [
+        ('removed', album_path)]
+
+
+def test_steady_events_flushed_by_max_delay(monkeypatch):
+    watcher = CollectionWatcher(None, None, delay=0.5, max_delay=1)
+    flushed = threading.Event()
+    monkeypatch.setattr(watcher, 'flush', flushed.set)
+
+    class Event(object):
+        path = '/collection/album'
+
+    for _ in range(30):
+        watcher._queue_event(Event())
+        if flushed.wait(0.1):
+            break
+
+    assert flushed.is_set()
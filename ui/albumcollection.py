@@ -92,7 +92,7 @@ class TrackNode(Node):
         return True
 
     def saveChanges(self):
-        Controller.flush_changes(self.wrapped)
+        controller.flush_changes(self.wrapped)
         self.dirty = False
 
 
@@ -159,6 +159,39 @@ class MusicCollectionModel(QAbstractItemModel):
 
         return albumNode
 
+    def albumNode(self, path):
+        row = self.albumRow(path)
+        return self.root.tracks[row] if row >= 0 else None
+
+    def albumRow(self, path):
+        """Row of the album at path under the root, or -1 if not shown"""
+        for row, node in enumerate(self.root):
+            if getattr(node.wrapped, 'path', None) == path:
+                return row
+
+        return -1
+
+    def updateAlbums(self, deltas):
+        """Applies a batch of controller.AlbumDelta (eg. from a watcher)
+
+        Albums are replaced by path. Albums holding unsaved edits are
+        left as they are.
+        """
+        self.beginResetModel()
+
+        for delta in deltas:
+            row = self.albumRow(delta.path)
+            if row >= 0:
+                if any(x.dirty for x in self.root.tracks[row]):
+                    continue
+
+                del self.root.tracks[row]
+
+            if delta.album is not None:
+                self.addAlbum(delta.album, callReset=False)
+
+        self.endResetModel()
+
     def rowCount(self, parent):
         node = self.nodeFromIndex(parent)
         if node is None or isinstance(node, TrackNode):
@@ -1,17 +1,28 @@
 import sys
 import os
 
-from PySide.QtCore import Qt, QModelIndex, QSettings
+from PySide.QtCore import Qt, QModelIndex, QSettings, QObject, Signal
 from PySide.QtGui import (QTreeView, QMainWindow, QFileSystemModel, QAction,
                           QDockWidget, QAbstractItemView, QHBoxLayout, QIcon,
                           QVBoxLayout, QWidget, QLineEdit, QPushButton,
                           QApplication, QFormLayout, QKeySequence,
-                          QMessageBox, QFileDialog)
+                          QMessageBox, QFileDialog, QDesktopServices)
 
 import albumcollection
 from r3tagger import controller
+from r3tagger.library.index import TagIndex
 #import qrc_resources
 
+try:
+    from r3tagger.library.watcher import CollectionWatcher
+except ImportError:  # inotify (pyinotify) is only available on Linux
+    CollectionWatcher = None
+
+
+class WatcherSignals(QObject):
+    """Carries watcher batches from its thread to the GUI thread"""
+    albumsChanged = Signal(object)
+
 
 class MainWindow(QMainWindow):
 
@@ -46,7 +57,25 @@ class MainWindow(QMainWindow):
         self.albumView.model().dataChanged.connect(self._setDirty)
 
         model = self.albumView.model()
-        model.dataChanged.connect(self.updateEditing)
+        model.dataChanged.connect(self.refreshEditing)
+        self.sharedTags = controller.SharedTags()
+        self.sharedTracks = {}
+
+        # Library index and watcher
+        dataDir = QDesktopServices.storageLocation(
+            QDesktopServices.DataLocation)
+        if not os.path.isdir(dataDir):
+            os.makedirs(dataDir)
+        indexPath = os.path.join(dataDir, 'library.db')
+        self.index = TagIndex(indexPath)
+
+        self.watcher = None
+        if CollectionWatcher is not None:
+            self.watcherSignals = WatcherSignals()
+            self.watcherSignals.albumsChanged.connect(model.updateAlbums)
+            self.watcher = CollectionWatcher(
+                TagIndex(indexPath), self.watcherSignals.albumsChanged.emit)
+            self.watcher.start()
 
         # Editing Group
         self.editingGroup = QFormLayout()
@@ -260,6 +289,9 @@ class MainWindow(QMainWindow):
             elif reply == QMessageBox.Yes:
                 self.confirmChanges()
 
+        if self.watcher is not None:
+            self.watcher.stop()
+
         settings = QSettings()
         settings.setValue("MainWindow/Geometry", self.saveGeometry())
         settings.setValue("MainWindow/State", self.saveState())
@@ -283,17 +315,29 @@ class MainWindow(QMainWindow):
             self.albumView.model().addAlbum(containerAlbum)
 
         else:
-            for album in controller.build_albums(path, recursive=True):
+            albums = controller.build_albums(path, recursive=True,
+                                             index=self.index)
+            for album in albums:
                 self.albumView.model().addAlbum(album)
 
+            if self.watcher is not None:
+                self.watcher.watch(path)
+
     def updateEditing(self, index):
         self.albumView.correctListingSelection(index)
 
-        selectedTracks = self.albumView.selectedTracks()
-        albumOfSingles = controller.album_from_tracks(selectedTracks)
-        selected = self.albumView.selectedAlbums()
-        selected.append(albumOfSingles)
-        tags = controller.find_shared_tags(*selected) if selected else {}
+        selected = {}
+        for album in self.albumView.selectedAlbums():
+            selected.update((id(x), x) for x in album)
+        selected.update((id(x), x) for x in self.albumView.selectedTracks())
+
+        # Only the tracks toggled since the last selection are fed
+        self.sharedTags.remove([x for key, x in self.sharedTracks.items()
+                                if key not in selected])
+        self.sharedTags.add([x for key, x in selected.items()
+                             if key not in self.sharedTracks])
+        self.sharedTracks = selected
+        tags = self.sharedTags.result() or {}
 
         for tag, edit in self.tagsToAttribs.items():
             if not tags:
@@ -302,6 +346,14 @@ class MainWindow(QMainWindow):
             edit.setText(tags.get(tag, ''))
             edit.setCursorPosition(0)
 
+    def refreshEditing(self, index):
+        self.resetEditing()
+        self.updateEditing(index)
+
+    def resetEditing(self):
+        self.sharedTags = controller.SharedTags()
+        self.sharedTracks = {}
+
     def confirmChanges(self):
         tags = {}
         for field, lineEdit in self.tagsToAttribs.items():
@@ -309,12 +361,17 @@ class MainWindow(QMainWindow):
             tags[field] = tag
 
         view = self.albumView
+        staged = []
 
         for album in view.selectedAlbums():
-            controller.retag_album(album, tags)
+            controller.retag_album(album, tags, commit=False)
+            staged.extend(album)
 
         for track in view.selectedTracks():
-            controller.retag_track(track, tags)
+            controller.retag_track(track, tags, commit=False)
+            staged.append(track)
+
+        controller.commit_tracks(staged, workers=0)
 
         self.saveChanges()
 
@@ -345,6 +402,7 @@ class MainWindow(QMainWindow):
         model = self.albumView.model()
         model.beginResetModel()
         self.clearEditing()
+        self.resetEditing()
 
         expanded = []
         rowCount = model.rowCount(QModelIndex())